@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+'''
+Batch processing of expressions: parse, differentiate and simplify
+
+Expressions are streamed from a file or stdin, one per line or as JSON lines
+like {"expr": "x^2*y", "wrt": "x"}, and farmed out in chunks to a pool of
+worker processes. Results come back in input order, one JSON object per
+input line, and an input that fails only records its error. At most a fixed
+number of chunks are in flight at once, so memory stays bounded however long
+the input is.
+
+usage: python batch.py [input] [-o output] [--format lines|jsonl] [--wrt x]
+                       [--no-simplify] [--workers N] [--chunk-size N]
+'''
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import calculus
+
+CHUNK_SIZE = 64 # number of expressions sent to a worker at a time
+
+def _rules():
+    '''the compiled rule set, built (or loaded from the on-disk cache) once per process'''
+    return calculus.default_rules()
+
+def process_line(index, line, input_format='lines', wrt=None, simplify=True):
+    '''parse, differentiate and simplify the expression on one input line,
+    returning a dictionary with the result or the error'''
+    result = {'index': index, 'expr': None, 'result': None, 'error': None}
+    try:
+        if input_format == 'jsonl':
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("Expected a JSON object with an 'expr' field")
+            mystr = item['expr']
+            wrt = item.get('wrt', wrt)
+        else:
+            mystr = line.strip()
+        result['expr'] = mystr
+        expr = calculus.str_to_expr(mystr)
+        if wrt is not None:
+            result['wrt'] = wrt
+            expr = calculus.deriv(expr, wrt)
+        if simplify:
+            expr = expr.simplify(_rules())
+        result['result'] = expr.collapse()
+    except Exception as error:
+        result['error'] = '{kind}: {message}'.format(kind=type(error).__name__, message=error)
+    return result
+
+def _process_chunk(chunk, input_format, wrt, simplify):
+    return [process_line(index, line, input_format, wrt, simplify) for index, line in chunk]
+
+def process_stream(lines, input_format='lines', wrt=None, simplify=True, workers=None, chunk_size=CHUNK_SIZE):
+    '''process an iterable of input lines, yielding a result dictionary (see
+    process_line) for each non-blank line, in input order. With workers=0 the
+    lines are processed in this process; otherwise they are sent in chunks
+    to a pool of that many processes (by default, one per CPU).'''
+    numbered = ((index, line) for index, line in enumerate(lines) if line.strip())
+    chunks = iter(lambda: list(itertools.islice(numbered, chunk_size)), [])
+    if workers == 0:
+        for chunk in chunks:
+            for result in _process_chunk(chunk, input_format, wrt, simplify):
+                yield result
+        return
+    if workers is None:
+        workers = os.cpu_count() or 1
+    max_pending = 2 * workers # chunks in flight, which bounds the memory used
+    with ProcessPoolExecutor(max_workers=workers, initializer=_rules) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_process_chunk, chunk, input_format, wrt, simplify))
+            if len(pending) >= max_pending:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parse, differentiate and simplify a stream of expressions.')
+    parser.add_argument('input', nargs='?', default='-', help="a file of expressions, or '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="where to write the JSON line results, or '-' for stdout")
+    parser.add_argument('--format', choices=['lines', 'jsonl'], default='lines',
+                        help="one expression per line, or JSON objects with 'expr' and optional 'wrt' fields")
+    parser.add_argument('--wrt', help='differentiate with respect to this variable')
+    parser.add_argument('--no-simplify', dest='simplify', action='store_false', help="don't simplify the results")
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes; 0 runs in this process')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='expressions per worker task')
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    errors = 0
+    try:
+        for result in process_stream(infile, args.format, args.wrt, args.simplify, args.workers, args.chunk_size):
+            if result['error'] is not None:
+                errors += 1
+            outfile.write(json.dumps(result) + '\n')
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    if errors:
+        sys.stderr.write('{errors} expression(s) failed\n'.format(errors=errors))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
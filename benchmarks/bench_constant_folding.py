@@ -0,0 +1,78 @@
+#!/usr/bin/python
+
+'''
+Compare the tree-based constant folder in calculus.py against the old path
+through collapse(), a regex check and eval().
+
+The old path only folded operators whose children were all leaves, so both
+folders are run bottom-up over the same trees: small numeric operators, and
+larger random trees of numbers with a few variables mixed in.
+
+usage: python benchmarks/bench_constant_folding.py [--repeat N] [--seed S]
+'''
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from calculus import Variable, Operator, fold_constants
+
+def legacy_fold_node(op):
+    '''the folding step of the old Operator.simplify'''
+    for child in op.children:
+        if isinstance(child, Operator):
+            return op
+    my_str = op.collapse()
+    if not re.search('[a-zA-Z_]', my_str): # if we don't find a letter in the string
+        my_str = re.sub(r'\^', '**', my_str) # replace the power operator with a form Python will understand
+        try:
+            return Variable(str(eval(my_str)))
+        except ZeroDivisionError:
+            return op
+    return op
+
+def legacy_fold(expr):
+    '''apply legacy_fold_node bottom-up, like the old simplify did'''
+    if isinstance(expr, Variable):
+        return expr
+    return legacy_fold_node(Operator(expr.name, [legacy_fold(child) for child in expr.children]))
+
+def random_tree(rng, depth, variable_fraction):
+    if depth == 0 or rng.random() < 0.2:
+        if rng.random() < variable_fraction:
+            return Variable(rng.choice('xyz'))
+        return Variable(str(rng.randint(1, 9)))
+    name = rng.choice('+-*/^')
+    if name == '^': # keep the powers small
+        return Operator(name, [random_tree(rng, depth - 1, variable_fraction), Variable(str(rng.randint(0, 3)))])
+    if name in '+*' and rng.random() < 0.5:
+        return Operator(name, [random_tree(rng, depth - 1, variable_fraction) for i in range(3)])
+    return Operator(name, [random_tree(rng, depth - 1, variable_fraction) for i in range(2)])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='timing repeats; the best is reported')
+    parser.add_argument('--seed', type=int, default=2016)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    workloads = [
+        ('leaf operators', [random_tree(rng, 1, 0.0) for i in range(2000)]),
+        ('numeric trees, depth 6', [random_tree(rng, 6, 0.0) for i in range(200)]),
+        ('mixed trees, depth 6', [random_tree(rng, 6, 0.3) for i in range(200)]),
+    ]
+    print('{0:<24} {1:>12} {2:>12} {3:>12} {4:>8}'.format('workload', 'eval (ms)', 'exact (ms)', 'float (ms)', 'speedup'))
+    for name, exprs in workloads:
+        legacy = min(timeit.repeat(lambda: [legacy_fold(expr) for expr in exprs], number=1, repeat=args.repeat))
+        exact = min(timeit.repeat(lambda: [fold_constants(expr) for expr in exprs], number=1, repeat=args.repeat))
+        inexact = min(timeit.repeat(lambda: [fold_constants(expr, exact=False) for expr in exprs], number=1, repeat=args.repeat))
+        print('{0:<24} {1:>12.2f} {2:>12.2f} {3:>12.2f} {4:>7.1f}x'.format(
+            name, legacy * 1000, exact * 1000, inexact * 1000, legacy / exact))
+
+if __name__ == '__main__':
+    main()
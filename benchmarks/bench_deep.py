@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+'''
+Run every traversal in calculus.py on very deep and very large expressions,
+with the recursion limit left at its default, and report the time each one
+takes. The expressions are
+
+- a chain of nested products, ((x*2)*x)*2..., 'depth' levels deep
+- a continued fraction 1/(1 + 1/(1 + ... x)), 'depth' levels deep
+- a balanced tree of sums and products with 'size' nodes
+
+Each one is written out with write_expr() and parsed back, which must give
+the identical expression, then differentiated, simplified and matched
+against a relation.
+
+usage: python benchmarks/bench_deep.py [--depth N] [--size N]
+'''
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import Variable, Operator
+
+def nested_products(depth):
+    x = Variable('x')
+    expr = x
+    for level in range(depth):
+        expr = Operator('*', [expr, Variable('2') if level % 2 else x])
+    return expr
+
+def continued_fraction(depth):
+    expr = Variable('x')
+    for level in range(depth):
+        expr = Operator('/', [Variable('1'), Operator('+', [Variable('1'), expr])])
+    return expr
+
+def balanced_tree(size):
+    # distinct leaves x0, x1, ... so the tree has no shared subexpressions
+    level = [Variable('x{n}'.format(n=n)) for n in range((size + 1) // 2)]
+    name = '+'
+    while len(level) > 1:
+        level = [Operator(name, level[index:index + 2]) if index + 1 < len(level) else level[index]
+                 for index in range(0, len(level), 2)]
+        name = '*' if name == '+' else '+'
+    return level[0]
+
+def timed(name, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print('  {0:<28} {1:>9.3f} s'.format(name, time.perf_counter() - start))
+    return result
+
+def depth_of(expr):
+    depth = 0
+    stack = [(expr, 1)]
+    while stack:
+        node, level = stack.pop()
+        depth = max(depth, level)
+        if isinstance(node, Operator):
+            stack.extend((child, level + 1) for child in node.children)
+    return depth
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--depth', type=int, default=50000, help='depth of the chained expressions')
+    parser.add_argument('--size', type=int, default=200000, help='number of nodes in the balanced tree')
+    args = parser.parse_args()
+    relation = calculus.make_relation('a * 1', 'a')
+    print('recursion limit: {limit}'.format(limit=sys.getrecursionlimit()))
+    for name, expr in (('nested products', nested_products(args.depth)),
+                       ('continued fraction', continued_fraction(args.depth)),
+                       ('balanced tree', balanced_tree(args.size))):
+        print('{name}: {nodes} distinct nodes, depth {depth}'.format(
+            name=name, nodes=len(calculus.unique_nodes(expr)), depth=depth_of(expr)))
+        buffer = io.StringIO()
+        timed('write_expr', calculus.write_expr, expr, buffer)
+        text = buffer.getvalue()
+        assert timed('collapse', expr.collapse) == text
+        assert timed('str_to_expr', calculus.str_to_expr, text, False) is expr, 'parsing did not round-trip'
+        variable = 'x' if name != 'balanced tree' else 'x0'
+        timed('deriv', calculus.deriv, expr, variable)
+        timed('simplify', expr.simplify)
+        timed('Relation.compare', relation.compare, expr)
+        timed('build_up_side', relation.build_up_side, expr, {})
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+'''
+Measure how long a new process takes to import calculus.py and to finish its
+first simplify(), with the on-disk rule cache cold (empty) and warm.
+
+Each measurement runs in a fresh interpreter, so nothing is shared between
+runs except the cache directory.
+
+usage: python benchmarks/bench_startup.py [--runs N]
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import calculus
+imported = time.perf_counter()
+calculus.str_to_expr('(x*1 + 0)^1').simplify()
+simplified = time.perf_counter()
+print(json.dumps({'import': imported - start, 'first_simplify': simplified - imported}))
+'''
+
+def probe(cache_dir):
+    environment = dict(os.environ, SYMBOLIC_CACHE_DIR=cache_dir)
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=ROOT, env=environment)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=9, help='processes started for each measurement')
+    args = parser.parse_args()
+    cache_dir = tempfile.mkdtemp(prefix='symbolic-bench-')
+    try:
+        cold = []
+        for run in range(args.runs):
+            shutil.rmtree(cache_dir)
+            os.mkdir(cache_dir)
+            cold.append(probe(cache_dir))
+        warm = [probe(cache_dir) for run in range(args.runs)]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print('{0:<12} {1:>12} {2:>22}'.format('cache', 'import (ms)', 'first simplify (ms)'))
+    for name, results in (('cold', cold), ('warm', warm)):
+        print('{0:<12} {1:>12.2f} {2:>22.2f}'.format(
+            name, median([result['import'] for result in results]) * 1000,
+            median([result['first_simplify'] for result in results]) * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+'''
+Compare Taylor-mode differentiation (taylor.py) with repeated deriv and
+simplify, for all of the derivatives of an expression up to a given order.
+
+For each expression and order, three ways of getting f, f', ..., f^(k) are
+timed:
+
+- deriv + simplify: differentiate and simplify k times, then evaluate each
+  derivative at the point with lambdify
+- taylor: one numeric pass of jets at the point
+- taylor symbolic: one symbolic pass, giving the derivatives as expressions
+
+along with the number of distinct nodes in the k-th derivative for the two
+symbolic methods. The numeric results are checked against each other.
+
+usage: python benchmarks/bench_taylor.py [--orders 2,4,6] [--repeat N]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+import taylor
+from evaluate import lambdify
+
+EXPRESSIONS = [
+    'x^3*y + y^2/x',
+    '(x*y + 1)/(x^2 + 1)',
+    '(x + y)^5*(x - 1)^3',
+    '(x^2 + 1)^(1/2)/(x + y)',
+]
+POINT = 2
+VALUES = {'y': 3}
+
+def by_deriv(expr, order):
+    derivatives = [expr]
+    for n in range(order):
+        calculus.clear_caches()
+        derivatives.append(calculus.deriv(derivatives[-1], 'x').simplify())
+    numbers = [lambdify(derivative, ['x', 'y'])(float(POINT), float(VALUES['y'])) for derivative in derivatives]
+    return numbers, derivatives[-1]
+
+def by_taylor(expr, order):
+    return taylor.derivatives(expr, 'x', order, point=POINT, values=VALUES)
+
+def by_taylor_symbolic(expr, order):
+    return taylor.derivatives(expr, 'x', order, symbolic=True)[-1]
+
+def best_time(repeat, function, *args):
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', default='2,4,6', help='comma-separated derivative orders (8 takes a while with deriv)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs; the best is kept')
+    args = parser.parse_args()
+    orders = [int(order) for order in args.orders.split(',')]
+
+    print('{0:<26} {1:>5} {2:>14} {3:>10} {4:>12} {5:>11} {6:>11}'.format(
+        'expression', 'order', 'deriv (ms)', 'jet (ms)', 'symbolic (ms)', 'deriv nodes', 'jet nodes'))
+    for text in EXPRESSIONS:
+        expr = calculus.str_to_expr(text)
+        for order in orders:
+            deriv_time, (expected, last_derivative) = best_time(args.repeat, by_deriv, expr, order)
+            jet_time, numbers = best_time(args.repeat, by_taylor, expr, order)
+            symbolic_time, last_coefficient = best_time(args.repeat, by_taylor_symbolic, expr, order)
+            for got, want in zip(numbers, expected):
+                assert abs(got - want) <= 1e-6 * max(1.0, abs(want)), (text, order, got, want)
+            print('{0:<26} {1:>5} {2:>14.2f} {3:>10.2f} {4:>12.2f} {5:>11} {6:>11}'.format(
+                text, order, deriv_time * 1000, jet_time * 1000, symbolic_time * 1000,
+                len(calculus.unique_nodes(last_derivative)), len(calculus.unique_nodes(last_coefficient))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+
+'''
+Seeded random generators of expressions and relations for the benchmarks
+
+Every generator takes a random.Random, so the same seed always gives the
+same workload.
+'''
+
+from calculus import Variable, Operator
+
+OPERATOR_MIX = {'+': 3, '*': 3, '-': 1, '/': 1, '^': 1} # relative weights
+
+def _choose(rng, weights):
+    total = sum(weights.values())
+    point = rng.uniform(0, total)
+    for name in sorted(weights):
+        point -= weights[name]
+        if point <= 0:
+            return name
+    return sorted(weights)[-1]
+
+def random_leaf(rng, variables, constant_fraction):
+    if rng.random() < constant_fraction:
+        return Variable(str(rng.randint(0, 9)))
+    return Variable(rng.choice(variables))
+
+def random_expression(rng, size, depth, operators=None, variables='xyz', sharing=0.0, constant_fraction=0.3):
+    '''returns a random expression with about 'size' nodes and at most
+    'depth' levels. 'operators' maps operator names to relative weights
+    (default OPERATOR_MIX); + and * sometimes get three children. With
+    probability 'sharing', a subexpression reuses one built earlier instead
+    of a new one, so the result is a DAG. Exponents are small integers, so
+    the expressions can be differentiated without blowing up.'''
+    if operators is None:
+        operators = OPERATOR_MIX
+    built = [] # (subexpression, size) pairs available for sharing
+
+    def build(size, depth):
+        if built and rng.random() < sharing:
+            for attempt in range(5): # reuse something that fits in the size budget
+                expr, expr_size = rng.choice(built)
+                if size // 2 <= expr_size <= size:
+                    return expr
+        if size <= 1 or depth <= 1:
+            return random_leaf(rng, variables, constant_fraction)
+        name = _choose(rng, operators)
+        if name == '^':
+            expr = Operator(name, [build(size - 2, depth - 1), Variable(str(rng.randint(0, 4)))])
+        else:
+            arity = 3 if name in '+*' and size > 6 and rng.random() < 0.3 else 2
+            remaining = size - 1
+            children = []
+            for index in range(arity - 1):
+                share = remaining // (arity - index)
+                share = max(1, min(remaining - (arity - index - 1), int(share * rng.uniform(0.5, 1.5))))
+                children.append(build(share, depth - 1))
+                remaining -= share
+            children.append(build(remaining, depth - 1))
+            expr = Operator(name, children)
+        built.append((expr, size))
+        return expr
+
+    return build(size, depth)
+
+def random_pattern(rng, size, pattern_variables='abc', operators=None):
+    '''returns the string of a random relation pattern with about 'size' nodes'''
+    if operators is None:
+        operators = OPERATOR_MIX
+    if size <= 1:
+        if rng.random() < 0.7:
+            return rng.choice(pattern_variables)
+        return str(rng.randint(0, 3))
+    name = _choose(rng, operators)
+    left = rng.randint(1, max(1, size - 2))
+    return '(' + random_pattern(rng, left, pattern_variables, operators) + ' ' + name + ' ' + \
+        random_pattern(rng, max(1, size - 1 - left), pattern_variables, operators) + ')'
+
+def random_relations(rng, count, size=5):
+    '''returns a flat list of 'count' relation string pairs, like
+    calculus.simplifications. Each right-hand side is one of the variables
+    of its left-hand side, or a constant.'''
+    relations = []
+    for index in range(count):
+        lhs = random_pattern(rng, rng.randint(3, size))
+        names = sorted(set(char for char in lhs if char in 'abc'))
+        rhs = rng.choice(names) if names and rng.random() < 0.8 else str(rng.randint(0, 1))
+        relations.extend([lhs, rhs])
+    return relations
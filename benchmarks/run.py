@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+'''
+The benchmark suite: time and peak memory of each phase of the pipeline on
+seeded synthetic workloads
+
+Each scenario generates its expressions with benchmarks/generators.py from a
+fixed seed, so every run measures the same work. The phases are
+
+    parse      str_to_expr on the expressions' strings, with the cache off
+    deriv      deriv with respect to x, with the memo table cleared first
+    simplify   simplify the derivatives with the scenario's rule set, with
+               the cache of simplified forms cleared first
+    compare    Relation.compare of every rule against every node (no index)
+    collapse   collapse the expressions to strings
+
+Times are the best of --repeat runs, and peak memory is measured with
+tracemalloc on a separate run. With --check, the times are compared against
+the limits in benchmarks/thresholds.json and the exit status is 1 if any
+phase is over its limit. --update-thresholds FACTOR rewrites that file with
+the measured times multiplied by FACTOR.
+
+usage: python benchmarks/run.py [--scenario NAME] [--repeat N] [--json FILE]
+                                [--check | --update-thresholds FACTOR]
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir))
+
+import calculus
+from generators import random_expression, random_relations
+
+THRESHOLDS = os.path.join(HERE, 'thresholds.json')
+SEED = 2016
+COMPARE_NODES = 200 # nodes per expression tried in the compare phase
+
+SCENARIOS = [
+    # name, expressions, size, depth, sharing, extra random relations
+    dict(name='small', count=200, size=50, depth=10, sharing=0.0, rules=0),
+    dict(name='medium', count=20, size=1000, depth=25, sharing=0.1, rules=0),
+    dict(name='large', count=2, size=20000, depth=40, sharing=0.1, rules=0),
+    dict(name='shared', count=5, size=5000, depth=40, sharing=0.4, rules=0),
+    dict(name='many-rules', count=20, size=1000, depth=25, sharing=0.1, rules=200),
+]
+
+PHASES = ['parse', 'deriv', 'simplify', 'compare', 'collapse']
+
+def build_workload(scenario, operators=None):
+    '''generate the expressions and rule set of a scenario'''
+    rng = random.Random('{seed}:{name}'.format(seed=SEED, name=scenario['name']))
+    exprs = [random_expression(rng, scenario['size'], scenario['depth'], operators=operators,
+                               sharing=scenario['sharing']) for index in range(scenario['count'])]
+    relation_strings = list(calculus.simplifications) + random_relations(rng, scenario['rules'])
+    relations = calculus.make_all_relations(relation_strings)
+    return {
+        'exprs': exprs,
+        'texts': [expr.collapse() for expr in exprs],
+        'derivatives': [calculus.deriv(expr, 'x') for expr in exprs],
+        'relations': relations,
+        'index': calculus.make_rule_index(relations),
+    }
+
+def phase_functions(workload):
+    def parse():
+        for text in workload['texts']:
+            calculus.str_to_expr(text, cache=False)
+    def deriv():
+        calculus.clear_caches()
+        for expr in workload['exprs']:
+            calculus.deriv(expr, 'x')
+    def simplify():
+        calculus.clear_caches()
+        for expr in workload['derivatives']:
+            expr.simplify(workload['index'])
+    def compare():
+        for expr in workload['exprs']:
+            for node in calculus.unique_nodes(expr)[:COMPARE_NODES]:
+                for relation in workload['relations']:
+                    relation.compare(node)
+    def collapse():
+        for expr in workload['exprs']:
+            expr.collapse()
+    return {'parse': parse, 'deriv': deriv, 'simplify': simplify, 'compare': compare, 'collapse': collapse}
+
+def measure(function, repeat):
+    '''returns the best time of 'repeat' runs, and the peak memory of one more'''
+    best = None
+    for run in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+def parse_operators(text):
+    '''parse an operator mix like '+=3,*=3,^=1' '''
+    operators = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        operators[name.strip()] = float(weight)
+    return operators
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', help='run only these scenarios (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='timing runs per phase; the best is kept')
+    parser.add_argument('--operators', type=parse_operators, help="operator weights, like '+=3,*=3,-=1,/=1,^=1'")
+    parser.add_argument('--json', help='also write the results to this file')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--check', action='store_true', help='fail if a phase is slower than its threshold')
+    group.add_argument('--update-thresholds', type=float, metavar='FACTOR',
+                       help='write the measured times times FACTOR as the new thresholds')
+    args = parser.parse_args()
+
+    scenarios = [scenario for scenario in SCENARIOS if not args.scenario or scenario['name'] in args.scenario]
+    thresholds = {}
+    if args.check:
+        with open(THRESHOLDS) as threshold_file:
+            thresholds = json.load(threshold_file)
+
+    results = {}
+    failures = []
+    print('{0:<12} {1:<10} {2:>10} {3:>12} {4:>10}'.format('scenario', 'phase', 'time (ms)', 'peak (KiB)', 'limit (ms)'))
+    for scenario in scenarios:
+        workload = build_workload(scenario, args.operators)
+        results[scenario['name']] = {}
+        for phase, function in sorted(phase_functions(workload).items(), key=lambda item: PHASES.index(item[0])):
+            elapsed, peak = measure(function, args.repeat)
+            results[scenario['name']][phase] = {'seconds': elapsed, 'peak_bytes': peak}
+            limit = thresholds.get(scenario['name'], {}).get(phase)
+            print('{0:<12} {1:<10} {2:>10.2f} {3:>12.1f} {4:>10}'.format(
+                scenario['name'], phase, elapsed * 1000, peak / 1024.0,
+                '' if limit is None else '{0:.2f}'.format(limit * 1000)))
+            if limit is not None and elapsed > limit:
+                failures.append('{scenario}/{phase}: {elapsed:.4f} s > {limit:.4f} s'.format(
+                    scenario=scenario['name'], phase=phase, elapsed=elapsed, limit=limit))
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2, sort_keys=True)
+    if args.update_thresholds:
+        new_thresholds = dict((name, dict((phase, round(result['seconds'] * args.update_thresholds, 4))
+                                          for phase, result in phases.items()))
+                              for name, phases in results.items())
+        with open(THRESHOLDS, 'w') as threshold_file:
+            json.dump(new_thresholds, threshold_file, indent=2, sort_keys=True)
+            threshold_file.write('\n')
+    if failures:
+        print('regressions:\n  ' + '\n  '.join(failures))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
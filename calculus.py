@@ -21,8 +21,18 @@ Ideas:
 
 '''
 
-import math, re
-from copy import deepcopy
+import math, re, os, sys, time
+import collections
+import contextlib
+import functools
+import hashlib
+import io
+import json
+import marshal
+import pickle
+import tempfile
+import weakref
+from fractions import Fraction
 
 simplifications = [ # we can assume that these commute
 'a + 0', 'a',
@@ -41,10 +51,43 @@ laws_of_algebra = [
 'a * b', 'b * a', # commutative property of multiplication   
 ]
 
-# idea: expression classes that point to further expression classes        
-class Variable(): # leaves on the tree
-    def __init__(self, value=None):
-        self.name = value
+# idea: expression classes that point to further expression classes
+
+# Every Variable and Operator is hash-consed: constructing a node that is
+# structurally identical to a live one returns the existing object. Nodes are
+# therefore immutable, subexpressions are shared rather than copied, and two
+# expressions are equal exactly when they are the same object.
+_unique_table = weakref.WeakValueDictionary()
+
+class Variable(object): # leaves on the tree
+    __slots__ = ('name', '_hash', '__weakref__')
+
+    def __new__(cls, value=None):
+        key = (value,)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            object.__setattr__(node, 'name', value)
+            object.__setattr__(node, '_hash', hash(key))
+            _unique_table[key] = node
+        return node
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Variable objects are immutable")
+
+    __delattr__ = __setattr__
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (Variable, (self.name,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __str__(self):
         return self.name
@@ -53,16 +96,44 @@ class Variable(): # leaves on the tree
         '''return a string representation of myself'''
         return self.name
     
-    def simplify(self, dummy_arg):
+    def simplify(self, dummy_arg=None, exact=True):
         return self
 
-class Operator(): # forks in the tree
-    def __init__(self, operator=None, children=[]):
-        self.name = operator
-        self.children = []
-        for child in children:
-            self.children.append(deepcopy(child))
-        self.str = ''
+    def replace(self, old, new=None):
+        '''returns the replacement for this variable (see Operator.replace), or itself'''
+        return _replacement_mapping(old, new).get(self, self)
+
+class Operator(object): # forks in the tree
+    __slots__ = ('name', 'children', '_hash', '__weakref__')
+
+    def __new__(cls, operator=None, children=()):
+        children = tuple(children) # the children are interned, so no copies are needed
+        key = (operator, children)
+        node = _unique_table.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            object.__setattr__(node, 'name', operator)
+            object.__setattr__(node, 'children', children)
+            object.__setattr__(node, '_hash', hash(key)) # the children's hashes are structural too
+            _unique_table[key] = node
+        return node
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Operator objects are immutable")
+
+    __delattr__ = __setattr__
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return (Operator, (self.name, self.children))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
     def __getitem__(self, key):
         return self.children[key]
@@ -72,86 +143,242 @@ class Operator(): # forks in the tree
 
     def collapse(self):
         '''Reduce this operator to a string representation of itself'''
-        collapsed_children = [] # creepy name
-        #print "collapsing operator:", self.name
-        for child in self.children:
-            #print "collapsing child:", child.name
-            collapsed_children.append(child.collapse())
-        self.str = '(' + self.name.join(collapsed_children) + ')'
-        return self.str
+        buffer = io.StringIO()
+        write_expr(self, buffer)
+        return buffer.getvalue()
       
-    def simplify(self, simplifications): 
-        '''simplify the expression by using simplification relations specified in the 'simplifications' list'''
-        new_children = []
-        all_variables = True
-        
-        if isinstance(self, Operator): 
-            for child in self.children: # loop thru the children of this expression
-                new_child = child.simplify(simplifications) # do again recursively
-                if isinstance(new_child, Operator):
-                    all_variables = False # all children are not variables
-                ''' # REMOVE
-                    for simpl in simplifications: # run through the possible simplifications
-                        comparison = simpl.compare(new_child) # see whether the two expressions compare
-                        if comparison: # if they compare
-                            new_child = comparison # then modify this operator to include the simplification
-                        else:
-                            new_child = new_child # otherwise, stay with the old expr
-                '''
-                new_children.append(new_child)
-            self.children = new_children
-            for simpl in simplifications: # run through the possible simplifications
-                comparison = simpl.compare(self) # see whether the two expressions compare
-                if comparison: # if they compare
-                    self = comparison # then modify this operator to include the simplification
-                    
-        else:
-            pass # because you cannot just simplify a variable
-        
-        '''
-        # OLD: REMOVE
-        
-        for child in self.children:
-            if isinstance(child, Operator): # then there is an operator in there
-                new_child = child.simplify(simplifications)
-                
-                if isinstance(new_child, Variable):
-                    pass
-                else:
-                    all_variables = False
-                    for simpl in simplifications: # run through the possible simplifications
-                        comparison = simpl.compare(child) # see whether the two expressions compare
-                        if comparison:
-                            new_child = comparison
-                        else:
-                            new_child = child
-                        
-                new_children.append(new_child)
+    def simplify(self, simplifications=None, exact=True): 
+        '''simplify the expression by using simplification relations specified in the 'simplifications' list.
+        The list may also be a RuleIndex, and defaults to default_rules(). Numeric constants are
+        folded along the way, exactly unless 'exact' is False (see fold_constants).
+        The expression is simplified bottom-up, each distinct subexpression once.'''
+        if simplifications is None:
+            simplifications = default_rules()
+        elif not isinstance(simplifications, RuleIndex):
+            simplifications = make_rule_index(simplifications)
+        if _profile is not None: # see enable_profiling
+            return _profile.simplify(self, simplifications, exact)
+        # simplified forms are remembered by the rule index, so subexpressions
+        # simplified before (say, the untouched parts of a replace()) are reused
+        cache = simplifications.simplified_cache(exact)
+        simplified = {} # node -> its simplified form
+        stack = [(self, False)]
+        while stack: # children come before their parents
+            node, children_done = stack.pop()
+            if node in simplified:
+                continue
+            if isinstance(node, Variable):
+                simplified[node] = node
+                continue
+            cached = cache.get(node)
+            if cached is not None:
+                simplified[node] = node if cached is _unchanged else cached
+            elif children_done:
+                new_children = [simplified[child] for child in node.children]
+                result = _simplify_node(node.name, new_children, simplifications, exact)
+                cache[node] = _unchanged if result is node else result # a value must not hold on to its key
+                simplified[node] = result
             else:
-                new_children.append(child)
-            
-                
-        self.children = new_children
-        #self.str = ''
-        '''
-        
-        if all_variables: # if the children are all variables
-            my_str = self.collapse()
-            #print "my_str:", my_str
-            if not re.search('[a-zA-Z_]', my_str): # if we don't find a letter in the string
-                my_str = re.sub('\^', '**', my_str) # replace the power operator with a form Python will understand
-                simplification = str(eval(my_str)) # evaluate this operation
-                #print "simplification:", simplification
-                return Variable(simplification)
-        
-        return self
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if child not in simplified)
+        return simplified[self]
     
-    def replace(self, old, new):
-        '''goes through this operator, replacing all instances of 'old' with 'new
+    def replace(self, old, new=None):
+        '''goes through this operator, replacing all instances of 'old' with 'new'
         returns a new operator with the changes implemented
-        '''
-        pass
-      
+
+        'old' may also be a dictionary from old to new expressions, which are
+        all replaced at once (so x -> y, y -> x swaps them). Strings are parsed
+        and numbers become leaves. Only the nodes on the paths from the
+        replacements up to the root are rebuilt; everything else is reused
+        as-is, so simplifying the result only redoes those nodes.'''
+        mapping = _replacement_mapping(old, new)
+        replaced = {} # node -> node after replacement
+        stack = [(self, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node in replaced:
+                continue
+            if node in mapping:
+                replaced[node] = mapping[node] # replacements aren't searched again
+            elif isinstance(node, Variable):
+                replaced[node] = node
+            elif children_done:
+                new_children = [replaced[child] for child in node.children]
+                if all(new_child is child for new_child, child in zip(new_children, node.children)):
+                    replaced[node] = node # nothing below changed
+                else:
+                    replaced[node] = Operator(node.name, new_children)
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if child not in replaced)
+        return replaced[self]
+
+def as_expression(value):
+    '''returns an expression for an expression, a string (which is parsed) or a number'''
+    if isinstance(value, (Variable, Operator)):
+        return value
+    if isinstance(value, str):
+        return str_to_expr(value)
+    if isinstance(value, (int, float, Fraction)):
+        return number_to_variable(value)
+    raise TypeError("Can't use {value!r} as an expression".format(value=value))
+
+def _replacement_mapping(old, new):
+    '''the {old expression: new expression} dictionary for replace()'''
+    if isinstance(old, dict):
+        assert new is None, "Give either a dictionary of replacements or an old and a new expression"
+        pairs = old.items()
+    else:
+        pairs = [(old, new)]
+    return dict((as_expression(key), as_expression(value)) for key, value in pairs)
+
+# Profiling is opt-in: while it is off, the only cost is one check of
+# _profile per call to simplify(). While it is on, simplify() goes through
+# SimplifyProfile.simplify, which runs the same _simplify_node with the
+# profile's counting and timing versions of its steps.
+_profile = None
+
+class SimplifyProfile(object):
+    '''statistics gathered from simplify() while profiling is enabled:
+
+    - for each relation, how often it was attempted (compared against a
+      node), matched, and fired (changed the node)
+    - the time spent looking up candidates in the rule index, comparing
+      (matching), constructing the results, and folding constants
+    - the number of distinct nodes before and after each simplify() call
+
+    on_rewrite, if given, is called as on_rewrite(relation, before, after)
+    every time a relation fires.'''
+    def __init__(self, on_rewrite=None, max_passes=1000):
+        self.on_rewrite = on_rewrite
+        self.max_passes = max_passes # only the most recent passes are kept
+        self.reset()
+
+    def reset(self):
+        self.rules = {} # relation -> [attempts, matches, fires]
+        self.seconds = {'lookup': 0.0, 'compare': 0.0, 'construct': 0.0, 'fold': 0.0, 'total': 0.0}
+        self.pass_count = 0
+        self.passes = collections.deque(maxlen=self.max_passes)
+
+    def simplify(self, expr, simplifications, exact):
+        '''the same as Operator.simplify, with counters and timers. The cache
+        of simplified forms is bypassed, so all of the work is counted.'''
+        clock = time.perf_counter
+        start = clock()
+        nodes = unique_nodes(expr)
+        simplified = {}
+        for node in nodes:
+            if isinstance(node, Variable):
+                simplified[node] = node
+            else:
+                simplified[node] = _simplify_node(node.name, [simplified[child] for child in node.children],
+                                                  simplifications, exact, self.fold, self.lookup, self.compare)
+        result = simplified[expr]
+        elapsed = clock() - start
+        self.seconds['total'] += elapsed
+        self.pass_count += 1
+        self.passes.append({'nodes_before': len(nodes), 'nodes_after': len(unique_nodes(result)), 'seconds': elapsed})
+        return result
+
+    # the steps of _simplify_node, counted and timed
+    def fold(self, name, children, exact):
+        start = time.perf_counter()
+        expr = fold_node(name, children, exact)
+        self.seconds['fold'] += time.perf_counter() - start
+        return expr
+
+    def lookup(self, simplifications, expr):
+        start = time.perf_counter()
+        candidates = simplifications.candidate_positions(expr)
+        self.seconds['lookup'] += time.perf_counter() - start
+        return candidates
+
+    def compare(self, relation, expr):
+        '''Relation.compare in two timed steps: match, then construct'''
+        counts = self.rules.get(relation)
+        if counts is None:
+            counts = self.rules[relation] = [0, 0, 0]
+        counts[0] += 1
+        start = time.perf_counter()
+        bindings = relation.match(expr)
+        self.seconds['compare'] += time.perf_counter() - start
+        if bindings is None:
+            return None
+        counts[1] += 1
+        start = time.perf_counter()
+        result = relation.build_up_side(relation.operator2, bindings)
+        self.seconds['construct'] += time.perf_counter() - start
+        if result is not expr:
+            counts[2] += 1
+            if self.on_rewrite is not None:
+                self.on_rewrite(relation, expr, result)
+        return result
+
+    def to_dict(self):
+        '''the statistics as plain data, with the rules sorted by attempts'''
+        rules = []
+        for relation, (attempts, matches, fires) in self.rules.items():
+            rules.append({'rule': '{lhs} -> {rhs}'.format(lhs=relation.str1, rhs=relation.str2),
+                          'attempts': attempts, 'matches': matches, 'fires': fires})
+        rules.sort(key=lambda rule: (-rule['attempts'], rule['rule']))
+        return {'passes': self.pass_count, 'seconds': dict(self.seconds), 'rules': rules,
+                'recent_passes': list(self.passes)}
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), **kwargs)
+
+    def unproductive_rules(self):
+        '''the rules that were attempted but never fired'''
+        return [rule for rule in self.to_dict()['rules'] if rule['attempts'] and not rule['fires']]
+
+def enable_profiling(on_rewrite=None, max_passes=1000):
+    '''start collecting statistics from simplify(), returning the SimplifyProfile'''
+    global _profile
+    _profile = SimplifyProfile(on_rewrite, max_passes)
+    return _profile
+
+def disable_profiling():
+    '''stop profiling, returning the SimplifyProfile (or None if it wasn't on)'''
+    global _profile
+    profile, _profile = _profile, None
+    return profile
+
+@contextlib.contextmanager
+def profiling(on_rewrite=None, max_passes=1000):
+    '''profile simplify() for the duration of a with block, which gets the SimplifyProfile'''
+    global _profile
+    previous = _profile
+    profile = enable_profiling(on_rewrite, max_passes)
+    try:
+        yield profile
+    finally:
+        _profile = previous
+
+def write_expr(expr, stream):
+    '''write the string form of an expression (the same as collapse()) to a
+    file-like object, piece by piece, without building the whole string'''
+    stack = [expr]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            stream.write(item)
+        elif isinstance(item, Variable):
+            stream.write(item.name)
+        else:
+            # push the pieces in reverse, so they come off the stack in order
+            stack.append(')')
+            children = item.children
+            for index in range(len(children) - 1, -1, -1):
+                child = children[index]
+                if isinstance(child, Variable) and (child.name[:1] == '-' or '/' in child.name):
+                    stack.append('(' + child.name + ')') # a negative or fractional number
+                else:
+                    stack.append(child)
+                if index or len(children) == 1: # operators go between children, or before a unary one's
+                    stack.append(item.name)
+            stack.append('(')
+
 class Relation():
     '''the purpose of relations is to link different expressions, and for simplification'''
     def __init__(self, my_str1='', my_str2='', operator1=None, operator2=None):
@@ -159,121 +386,316 @@ class Relation():
         self.operator2 = operator2
         self.str1 = my_str1
         self.str2 = my_str2
+        self.source = None # the generated Python source, once compiled
+        self._code = None
+        self._constants = None
+        self._matcher = None
+        self._rewriter = None
     
-    def break_down_side(self, rel_operator, exp_operator, _depth=0):
-        '''Part of constructing an equivalent expression in a relation.
-        By default, the LHS is broken down. This function is performed
-        recursively, and kept track by means of the _depth variable
+    def match(self, expr, pattern=None):
+        '''match an expression against one side of the relation (by default the
+        LHS) in a single traversal. Returns a dictionary binding each pattern
+        variable to the subexpression it stands for, or None if they don't
+        match. A pattern variable that appears more than once, like the 'a'
+        in 'a - a', must stand for the same subexpression each time.
         '''
-        # walk through the children belonging to both the representation and the expression
-        # comparing them one by one. When a variable is found in the representation,
-        # then save it in the rep_dict as the key, and the expression as the value.
-        rel_dict = {} # a dictionary that keeps track of the variables in the relation
-        #print "rel_operator.name:", rel_operator.name
-        #print "exp_operator.name:", exp_operator.name
-        if isinstance(rel_operator, Variable): # only adding a leaf expression to the dictionary
-            #print "found leaf:", rel_operator.name
-            rel_dict[rel_operator.name] = exp_operator
-        else: # then its an Operator
-            for i in range(len(rel_operator.children)): # loop thru the children
-                rel_child = rel_operator.children[i]
-                exp_child = exp_operator.children[i]
-                child_rel_dict = self.break_down_side(rel_child, exp_child, _depth=_depth+1) # calling them recursively
-                rel_dict.update(child_rel_dict) # combine the dictionary found in the recursion
-                
-        return rel_dict     
+        if pattern is None:
+            if self._matcher is not None:
+                return self._matcher(expr)
+            pattern = self.operator1
+        rel_dict = {}
+        stack = [(pattern, expr)]
+        while stack:
+            rel_operator, exp_operator = stack.pop()
+            if isinstance(rel_operator, Variable):
+                if is_alphabet(rel_operator.name): # a pattern variable
+                    bound = rel_dict.get(rel_operator.name)
+                    if bound is None:
+                        rel_dict[rel_operator.name] = exp_operator
+                    elif bound is not exp_operator: # expressions are interned, so this is equality
+                        return None
+                elif rel_operator is not exp_operator: # a literal must be the same leaf
+                    return None
+            else: # then its an Operator
+                if not isinstance(exp_operator, Operator) or exp_operator.name != rel_operator.name \
+                        or len(exp_operator.children) != len(rel_operator.children):
+                    return None
+                stack.extend(zip(rel_operator.children, exp_operator.children))
+        return rel_dict
         
     def build_up_side(self, rel_expression, rel_dict):
         '''The second half of the construction of an equivalent expression in a
         relation. By default, the RHS of the relation is built back up.
         '''
-        #print "rel_dict:", rel_dict #, "rel_expression:", rel_expression.collapse()
         assert rel_expression, "None expression caught"
-        
-        if isinstance(rel_expression, Variable):
-            #print "Variable found:", rel_expression.name
-            if rel_expression.name in rel_dict.keys(): # if this variable is in the dictionary
-                #print "building up:", rel_dict[rel_expression.name]
-                return rel_dict[rel_expression.name] # then return this expression
-            else: # then it wasn't found in the dictionary
-                return rel_expression # then just return whatever was in this relation
-        else: # then it's an operator, we will need to call children recursively
-            new_children = []
-            new_operation = rel_expression.operator
-            for i in range(len(rel_expression.children)): # loop thru the children
-                #print "Operator my_expression:", rel_expression.name
-                rel_child = rel_expression.children[i]
-                new_child = self.build_up_side(rel_child, rel_dict) #recursive call on child
-                new_children.append(new_child)
-            new_expr = Operator(new_operation, new_children) # create a new expression with the proper variables in place
-            #print "building up:", new_expr.collapse()
-        return new_expr
+        built = {} # pattern node -> the expression it becomes
+        for node in unique_nodes(rel_expression):
+            if isinstance(node, Variable):
+                # a bound variable becomes its expression, anything else stays as it is
+                built[node] = rel_dict.get(node.name, node)
+            else: # the matched subexpressions are shared, not copied
+                built[node] = Operator(node.name, [built[child] for child in node.children])
+        return built[rel_expression]
     
     def construct(self, src_expr, src_side=1):
-        '''given that an operator matches this relation, will return the resulting operator as predicted by the match'''
+        '''given an operator, will return the resulting operator as predicted by
+        matching it against one side of this relation, or None if it doesn't match'''
         assert src_side in [1,2], "The 'side' variable must be 1 or 2. Value not allowed: {side}".format(side=src_side)
         if src_side == 1: # breaking down the LHS
+            if self._rewriter is not None:
+                return self._rewriter(src_expr)
             breakdown_operator = self.operator1
             buildup_operator = self.operator2
         elif src_side == 2: # breaking down the RHS
             breakdown_operator = self.operator2
             buildup_operator = self.operator1
-        dest_side = (src_side%2)+1 # get opposite of 1 or 2
-        rep_dict = self.break_down_side(breakdown_operator, src_expr)
+        rep_dict = self.match(src_expr, breakdown_operator)
+        if rep_dict is None:
+            return None
         new_expr = self.build_up_side(buildup_operator, rep_dict)
         return new_expr
     
     def compare(self, operator, my_operator=None, both_ways=False):
-        '''compare myself to some expression (operation) to see whether we are comparable'''
-        compares = None
-        if my_operator==None: # then nobody provided anything
-            my_operator = self.operator1
-        if isinstance(operator, Variable):
-            if isinstance(my_operator, Variable): # if they are both variables
-                if is_numeric(my_operator.name): # if the relation is a numerical value
-                    if operator.name == my_operator.name: # they must have the same numerical value
-                        return operator
-                        #return self.construct(operator) # they match, so return the operator itself
-                    #else:
-                    #    return False
-                elif is_alphabet(my_operator.name): # the relation is an alphabetic value
-                    return operator
-                    #return self.construct(operator) # they match, so return the operator
-            #elif isinstance(self.operator1, Operator): # THIS WILL NEVER MATCH
-            #    return False
-                
-        elif isinstance(operator, Operator):
-            if isinstance(my_operator, Variable): # an operator matching a relation variable
-                if is_alphabet(my_operator.name): # the relation is an alphabetic value
-                    return self.construct(operator) # then the operator matches the relation
-                    
-            elif isinstance(my_operator, Operator):
-                if my_operator.name == operator.name: # then the relation has the same operation
-                    # now see if the children match the provided pattern
-                    if len(my_operator.children) == len(operator.children): # make sure we have the same number of children
-                        #children_match = [] # a list of matching children
-                        brokeout = False
-                        for index in range(len(my_operator.children)):
-                            op_child = operator.children[index] # operator child
-                            rel_child = my_operator.children[index] # relation child
-                            this_child = self.compare(op_child, rel_child)# then submit recursively
-                            if not this_child: # if the child is still not matched
-                                brokeout = True
-                                break
-                        if brokeout == False:
-                            return self.construct(operator) # if we made it through the children, then the match is True
-                      
-        if both_ways == True: # then compare the relation backwards as well # TODO: fill this out eventually
-            if self.operator2 == operator.name: # then the relation has the same operation
-            # now see if the children match the provided pattern
-                pass
-        
+        '''compare myself to some expression (operation) to see whether we are
+        comparable. Returns the equivalent expression if so, otherwise None'''
+        if my_operator is not None and my_operator is not self.operator1: # a pattern other than the LHS
+            rep_dict = self.match(operator, my_operator)
+            if rep_dict is None:
+                return None
+            return self.build_up_side(self.operator2, rep_dict)
+        compares = self.construct(operator)
+        if compares is None and both_ways == True: # then compare the relation backwards as well
+            compares = self.construct(operator, src_side=2)
         return compares
 
+    def compile(self):
+        '''generate a Python function specialized to this relation that matches
+        the LHS and builds the RHS directly, and use it from now on for
+        match(), construct() and compare(). Returns the relation.'''
+        self.source, self._code, self._constants = _compile_relation(self)
+        self._matcher, self._rewriter = _link_relation(self._code, self._constants)
+        return self
+
+    def __getstate__(self):
+        '''functions can't be pickled, so a compiled relation keeps its code
+        object, marshalled, and links it again when it is loaded'''
+        state = dict(self.__dict__)
+        state['_matcher'] = state['_rewriter'] = None
+        if state['_code'] is not None:
+            state['_code'] = marshal.dumps(state['_code'])
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._code is not None:
+            self._code = marshal.loads(self._code)
+            self._matcher, self._rewriter = _link_relation(self._code, self._constants)
+
+def _compile_relation(relation):
+    '''write the source of a matcher and a rewriter function for a relation,
+    returning the source and the two functions'''
+    namespace = {'Operator': Operator}
+    lines = []
+    bound = {} # pattern variable -> local name holding its subexpression
+    stack = [(relation.operator1, 'e0')]
+    count = 1
+    while stack:
+        pattern, local = stack.pop()
+        if isinstance(pattern, Variable):
+            if is_alphabet(pattern.name):
+                if pattern.name in bound: # a repeated variable must be the same subexpression
+                    lines.append("if {local} is not {other}: return None".format(local=local, other=bound[pattern.name]))
+                else:
+                    bound[pattern.name] = local
+            else:
+                constant = 'k{n}'.format(n=len(namespace))
+                namespace[constant] = pattern
+                lines.append("if {local} is not {constant}: return None".format(local=local, constant=constant))
+        else:
+            lines.append("if {local}.__class__ is not Operator or {local}.name != {name!r} "
+                         "or len({local}.children) != {arity}: return None".format(
+                             local=local, name=pattern.name, arity=len(pattern.children)))
+            if pattern.children:
+                child_locals = ['e{n}'.format(n=count + i) for i in range(len(pattern.children))]
+                count += len(pattern.children)
+                lines.append("{targets}, = {local}.children".format(targets=', '.join(child_locals), local=local))
+                stack.extend(reversed(list(zip(pattern.children, child_locals))))
+
+    def build(rhs):
+        '''the source of an expression that builds the RHS from the bound locals'''
+        if isinstance(rhs, Variable) and rhs.name in bound:
+            return bound[rhs.name]
+        if isinstance(rhs, Operator) and any(isinstance(node, Variable) and node.name in bound
+                                             for node in _pattern_leaves(rhs)):
+            return "Operator({name!r}, ({children},))".format(
+                name=rhs.name, children=', '.join(build(child) for child in rhs.children))
+        constant = 'k{n}'.format(n=len(namespace)) # a subexpression without variables is built once
+        namespace[constant] = rhs
+        return constant
+
+    body = ''.join('    ' + line + '\n' for line in lines)
+    bindings = ', '.join('{name!r}: {local}'.format(name=name, local=local) for name, local in sorted(bound.items()))
+    source = "def match(e0):\n" + body + "    return {" + bindings + "}\n\n"
+    source += "def rewrite(e0):\n" + body + "    return " + build(relation.operator2) + "\n"
+    code = compile(source, '<relation {lhs!r} -> {rhs!r}>'.format(lhs=relation.str1, rhs=relation.str2), 'exec')
+    del namespace['Operator']
+    return source, code, namespace
+
+def _link_relation(code, constants):
+    '''run the compiled code of a relation, returning its matcher and rewriter'''
+    namespace = dict(constants)
+    namespace['Operator'] = Operator
+    exec(code, namespace)
+    return namespace['match'], namespace['rewrite']
+
+def _pattern_leaves(pattern):
+    '''yield the leaves of a pattern'''
+    stack = [pattern]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Variable):
+            yield node
+        else:
+            stack.extend(node.children)
+
+# Relation patterns are indexed in a discrimination tree: each pattern is
+# flattened in preorder into keys naming the operator and its arity, or the
+# literal leaf, with pattern variables becoming wildcards that swallow a whole
+# subexpression. Looking up an expression only follows branches that agree
+# with it, so rules whose root operator, arity or literals can't match are
+# never compared.
+_WILDCARD = None
+
+def _pattern_key(expr):
+    '''the discrimination tree key for a single node'''
+    if isinstance(expr, Operator):
+        return ('op', expr.name, len(expr.children))
+    return ('leaf', expr.name)
+
+def _pattern_keys(pattern):
+    '''flatten a relation pattern into its preorder list of keys'''
+    keys = []
+    stack = [pattern]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Variable) and is_alphabet(node.name): # a pattern variable
+            keys.append(_WILDCARD)
+        else:
+            keys.append(_pattern_key(node))
+            if isinstance(node, Operator):
+                stack.extend(reversed(node.children))
+    return keys
+
+class _DiscriminationNode(object):
+    __slots__ = ('edges', 'positions')
+
+    def __init__(self):
+        self.edges = {} # key -> _DiscriminationNode
+        self.positions = [] # the rules whose pattern ends here
+
+class RuleIndex(object):
+    '''a list of relations compiled into a discrimination tree, so that an
+    expression is only compared against the relations that could match it'''
+    def __init__(self, relations):
+        self.relations = list(relations)
+        self._root = _DiscriminationNode()
+        for position, relation in enumerate(self.relations):
+            node = self._root
+            for key in _pattern_keys(relation.operator1):
+                if key not in node.edges:
+                    node.edges[key] = _DiscriminationNode()
+                node = node.edges[key]
+            node.positions.append(position)
+        self.clear_cache()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_simplified'] # weak references can't be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.clear_cache()
+
+    def simplified_cache(self, exact=True):
+        '''the table of expressions simplified with these rules, from each
+        node to its simplified form (or _unchanged)'''
+        return self._simplified[exact]
+
+    def clear_cache(self):
+        self._simplified = {True: weakref.WeakKeyDictionary(), False: weakref.WeakKeyDictionary()}
+
+    def __len__(self):
+        return len(self.relations)
+
+    def __iter__(self):
+        return iter(self.relations)
+
+    def candidate_positions(self, expr):
+        '''returns the sorted positions of the relations that might match expr'''
+        positions = []
+        # the expressions still to be matched are kept as a linked list of (expr, rest) pairs
+        work = [(self._root, (expr, None))]
+        while work:
+            node, pending = work.pop()
+            if pending is None: # the whole pattern was matched
+                positions.extend(node.positions)
+                continue
+            current, rest = pending
+            if _WILDCARD in node.edges: # a pattern variable takes the whole subexpression
+                work.append((node.edges[_WILDCARD], rest))
+            next_node = node.edges.get(_pattern_key(current))
+            if next_node is not None:
+                if isinstance(current, Operator):
+                    for child in reversed(current.children):
+                        rest = (child, rest)
+                work.append((next_node, rest))
+        positions.sort()
+        return positions
+
+    def candidates(self, expr):
+        '''returns the relations that might match expr, in their original order'''
+        return [self.relations[position] for position in self.candidate_positions(expr)]
+
+    def lookup(self, expr):
+        '''returns a pair of lists: the relations that might match expr, and
+        the relations that were pruned without being compared'''
+        positions = set(self.candidate_positions(expr))
+        candidates = []
+        pruned = []
+        for position, relation in enumerate(self.relations):
+            if position in positions:
+                candidates.append(relation)
+            else:
+                pruned.append(relation)
+        return candidates, pruned
+
+RULE_INDEX_CACHE_SIZE = 32 # number of rule indexes remembered by make_rule_index
+_rule_index_cache = collections.OrderedDict() # tuple of relations -> RuleIndex, least recently used first
+_unchanged = object() # marks a cached expression that simplifies to itself
+
+def make_rule_index(relations):
+    '''returns a RuleIndex for a list of Relation objects, such as the one
+    returned by make_all_relations. Indexes are remembered, so passing the
+    same relations again is cheap. Only the RULE_INDEX_CACHE_SIZE most
+    recently used indexes are kept, since relations compare by identity and
+    every call to make_all_relations makes new ones.'''
+    if isinstance(relations, RuleIndex):
+        return relations
+    key = tuple(relations)
+    index = _rule_index_cache.get(key)
+    if index is None:
+        index = RuleIndex(key)
+        _rule_index_cache[key] = index
+        while len(_rule_index_cache) > RULE_INDEX_CACHE_SIZE:
+            _rule_index_cache.popitem(last=False)
+    else:
+        _rule_index_cache.move_to_end(key)
+    return index
+
 def op2rel(op):
     '''converts a Operator object to a Relation object.'''
     #new_str = op.str
-    print "OP2REL ENTERED"
     rel = Relation(my_str1='', operator1=op)
     return rel
 
@@ -286,45 +708,310 @@ def is_alphabet(str):
   
 def is_numeric(str):
     '''returns whether a string is numeric'''
-    if re.match('[0-9]+',str):
+    if re.match(r'-?\.?[0-9]',str):
         return True
     else:
         return False
 
-def make_operator(mystr, spots, pos_spot, neg_spot=None):
-    '''given a string and the positions of operators, returns an operator object'''
-    old_spot = 0
-    expr_list = []
-    for spot in spots:
-        if spot > 0: # then it's an add
-            new_spot = spot
-            operator = pos_spot
-        elif spot < 0: # then it's a subtract
-            new_spot = -spot
-            operator = neg_spot
-        branch = mystr[old_spot:new_spot]
-        sub_expr = str_to_expr(branch)
-        expr_list.append(sub_expr)
-        #expr_list.append(operator) # Operator?
-        old_spot = new_spot + 1
-    branch = mystr[old_spot:]
-    sub_expr = str_to_expr(branch)
-    expr_list.append(sub_expr)
-    return Operator(operator, expr_list)
-
-def make_all_relations(relations):
-    '''returns a list of rel objects'''
+# Constant folding works on the tree itself with exact rational arithmetic:
+# numeric leaves are read as Fractions, so '1/2' stays 1/2 instead of becoming
+# 0.5, and results are written back as integer or 'p/q' leaves. In float mode
+# the arithmetic is done with Python floats instead.
+_max_folded_exponent = 4096 # larger integer powers are left unevaluated
+_max_folded_bits = 8192 # as are results whose numerator or denominator would be bigger than this
+# (the limit only decides what gets folded; number_to_variable writes any size)
+
+def _bit_size(value):
+    '''the bits in the numerator or denominator of an exact value, whichever is bigger'''
+    if isinstance(value, int):
+        return abs(value).bit_length()
+    if isinstance(value, Fraction):
+        return max(abs(value.numerator).bit_length(), value.denominator.bit_length())
+    return 0 # floats have a fixed size
+
+@functools.lru_cache(maxsize=4096)
+def numeric_value(name):
+    '''returns the exact value of a numeric leaf name as an integer or a
+    Fraction, or None if it isn't a number'''
+    if not is_numeric(name):
+        return None
+    try:
+        return int(name)
+    except ValueError:
+        pass
+    try:
+        return Fraction(name)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+def number_to_variable(value):
+    '''returns a leaf for a Fraction, integer or float, or None if the value
+    can't be written as a number (like inf or nan)'''
+    if isinstance(value, float):
+        if math.isinf(value) or math.isnan(value):
+            return None
+        return Variable(repr(value))
+    if isinstance(value, int):
+        return Variable(str(value))
+    if value.denominator != 1:
+        return Variable('{num}/{den}'.format(num=value.numerator, den=value.denominator))
+    return Variable(str(int(value)))
+
+def _bounded(value):
+    '''the value, or None if it is too big to be worth folding into a leaf'''
+    return None if _bit_size(value) > _max_folded_bits else value
+
+def apply_operator(name, values, exact=True):
+    '''apply an operator to numeric values: exactly, to integers and
+    Fractions, if exact is True, and otherwise to floats. Raises
+    ZeroDivisionError or OverflowError as Python's arithmetic does, and
+    ValueError if the result isn't a real number (or an exact one)'''
+    if name == '+':
+        return sum(values[1:], values[0])
+    if name == '*':
+        result = values[0]
+        for value in values[1:]:
+            result *= value
+        return result
+    if name == '-':
+        if len(values) == 1:
+            return -values[0]
+        result = values[0]
+        for value in values[1:]:
+            result -= value
+        return result
+    if len(values) != 2 or name not in ('/', '^'):
+        raise ValueError("Can't evaluate operator {name!r} with {count} operand(s)".format(name=name, count=len(values)))
+    left, right = values
+    if name == '/':
+        if exact:
+            return Fraction(left) / right
+        return left / right
+    if exact:
+        if Fraction(right).denominator != 1:
+            raise ValueError("A power with the exponent {exponent} can't be evaluated exactly".format(exponent=right))
+        if right < 0:
+            return Fraction(left) ** int(right)
+        return left ** int(right)
+    result = left ** right
+    if isinstance(result, complex):
+        raise ValueError("({base})^({exponent}) is not a real number".format(base=left, exponent=right))
+    return result
+
+def _apply_numeric(name, values, exact):
+    '''apply an operator to numeric values for folding, returning None if the
+    result can't be computed (exactly, if exact is True) or would be too big
+    to be worth writing out'''
+    if exact: # estimate the size first, since computing it could take a while
+        if name == '*' and sum(_bit_size(value) for value in values) > _max_folded_bits:
+            return None
+        if name == '/' and len(values) == 2 and _bit_size(values[0]) + _bit_size(values[1]) > _max_folded_bits:
+            return None
+        if name == '^' and len(values) == 2:
+            base, exponent = values
+            if abs(exponent) > _max_folded_exponent or _bit_size(base) * abs(exponent) > _max_folded_bits:
+                return None
+    try:
+        return _bounded(apply_operator(name, values, exact))
+    except (ArithmeticError, ValueError):
+        return None
+
+def fold_node(name, children, exact=True):
+    '''build the operator 'name' over already-folded children, folding its
+    numeric children. Sums and products fold all of their numeric children
+    together, so 2*x*3 becomes 6*x, and the constant always goes in front of
+    a product and at the end of a sum, so x*2 and 2*x are both 2*x.'''
+    values = []
+    for child in children:
+        if isinstance(child, Variable):
+            value = numeric_value(child.name)
+            if value is not None and not exact:
+                value = float(value)
+            values.append(value)
+        else:
+            values.append(None)
+    numeric = [value for value in values if value is not None]
+    if not numeric:
+        return Operator(name, children)
+    if len(numeric) == len(values): # everything is a number
+        result = _apply_numeric(name, numeric, exact)
+        if result is not None:
+            folded = number_to_variable(result)
+            if folded is not None:
+                return folded
+        return Operator(name, children)
+    if name not in ('+', '*'):
+        return Operator(name, children)
+    constant = _apply_numeric(name, numeric, exact)
+    if constant is None: # too big to fold
+        return Operator(name, children)
+    others = [child for child, value in zip(children, values) if value is None]
+    if name == '*' and constant == 0:
+        return number_to_variable(constant)
+    if constant != (0 if name == '+' else 1): # leave out the identity
+        folded = number_to_variable(constant)
+        if folded is None:
+            return Operator(name, children)
+        if name == '*': # constants go in front of products and at the end of sums
+            others.insert(0, folded)
+        else:
+            others.append(folded)
+    if len(others) == 1:
+        return others[0]
+    return Operator(name, others)
+
+def fold_constants(expr, exact=True):
+    '''evaluate the numeric parts of an expression directly on the tree. With
+    exact=True, the arithmetic is done with Fractions and integers; otherwise
+    with floats. Returns the folded expression.'''
+    folded = {} # node -> folded node, so shared subexpressions are folded once
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if node in folded:
+            continue
+        if isinstance(node, Variable):
+            folded[node] = node
+        elif children_done:
+            folded[node] = fold_node(node.name, [folded[child] for child in node.children], exact)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children if child not in folded)
+    return folded[expr]
+
+def _simplify_node(name, children, simplifications, exact,
+                   fold=fold_node, lookup=RuleIndex.candidate_positions, compare=Relation.compare):
+    '''simplify the operator 'name' over already-simplified children. The
+    steps are parameters so that SimplifyProfile can count and time them
+    without any cost here when profiling is off.'''
+    expr = fold(name, children, exact) # nodes are immutable, so this builds a new one
+    if isinstance(expr, Variable): # folded down to a number
+        return expr
+    # run through the possible simplifications in order, but only those the index can't rule out
+    position = 0 # rules before this position have already been tried
+    while True:
+        for candidate in lookup(simplifications, expr):
+            if candidate < position:
+                continue
+            comparison = compare(simplifications.relations[candidate], expr) # see whether the two expressions compare
+            if comparison is not None: # if they compare
+                expr = comparison # then modify this operator to include the simplification
+                position = candidate + 1
+                break
+        else: # none of the remaining candidates matched
+            break
+    return expr
+
+def unique_nodes(expr):
+    '''returns a list of the distinct nodes in an expression, each one after
+    all of its children. Shared subexpressions appear once.'''
+    nodes = []
+    seen = set()
+    stack = [(expr, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done:
+            nodes.append(node)
+        elif node not in seen:
+            seen.add(node)
+            stack.append((node, True))
+            if isinstance(node, Operator):
+                stack.extend((child, False) for child in reversed(node.children) if child not in seen)
+    return nodes
+
+def variables(expr):
+    '''returns the set of variable names (the non-numeric leaves) in an expression'''
+    return set(node.name for node in unique_nodes(expr)
+               if isinstance(node, Variable) and numeric_value(node.name) is None)
+
+def flatten(expr):
+    '''returns an expression where sums of sums and products of products are
+    merged into single n-ary operators, so (a+b)+c becomes a+b+c'''
+    flat = {} # node -> flattened node
+    for node in unique_nodes(expr):
+        if isinstance(node, Variable):
+            flat[node] = node
+            continue
+        children = []
+        for child in node.children:
+            child = flat[child]
+            if node.name in _flattened_operators and isinstance(child, Operator) and child.name == node.name:
+                children.extend(child.children)
+            else:
+                children.append(child)
+        flat[node] = Operator(node.name, children)
+    return flat[expr]
+
+def make_all_relations(relations, compiled=False):
+    '''returns a list of rel objects. If compiled is True, each relation is
+    compiled into a specialized Python matcher (see Relation.compile)'''
     assert len(relations) % 2 == 0, 'There must be an odd number of relations.'
-    num_rels = len(relations) / 2
+    num_rels = len(relations) // 2
     rel_list = []
     for i in range(num_rels): 
         str1 = relations[i*2]
         str2 = relations[i*2+1]
-        print "str1:", str1, "str2:", str2
         rel = make_relation(str1, str2)
+        if compiled:
+            rel.compile()
         rel_list.append(rel)
     return rel_list
 
+# Compiled rule sets are cached on disk, so that new processes start warm.
+# The cache file is named after a hash of the relation strings and the Python
+# version, since the compiled matchers are stored as marshalled code objects.
+RULE_CACHE_DIR = os.environ.get('SYMBOLIC_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'symbolic'))
+_RULE_CACHE_FORMAT = 1 # bump when RuleIndex or Relation change shape
+
+def _rule_cache_path(relations, compiled, cache_dir):
+    key = json.dumps([_RULE_CACHE_FORMAT, sys.version, list(relations), compiled])
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'rules-{digest}.pickle'.format(digest=digest[:32]))
+
+def load_rules(relations, compiled=True, cache_dir=None):
+    '''returns a RuleIndex for a list of relation strings (like
+    'simplifications'), loading it from the on-disk cache in 'cache_dir'
+    (default RULE_CACHE_DIR) when it is there and saving it there when it
+    isn't. Pass cache_dir=False to skip the cache.
+
+    The cache is skipped when this module is run as a script: the pickles
+    name their classes by module, so ones written from __main__ couldn't be
+    loaded by importers, and ones loaded there would be instances of a
+    second copy of the module, which never match this one's nodes.'''
+    if cache_dir is None:
+        cache_dir = RULE_CACHE_DIR
+    if not cache_dir or __name__ == '__main__':
+        return RuleIndex(make_all_relations(relations, compiled=compiled))
+    path = _rule_cache_path(relations, compiled, cache_dir)
+    try:
+        with open(path, 'rb') as cache_file:
+            index = pickle.load(cache_file)
+        if type(index) is RuleIndex:
+            return index
+    except Exception: # a missing, stale or unreadable cache is just rebuilt
+        pass
+    index = RuleIndex(make_all_relations(relations, compiled=compiled))
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        handle, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(handle, 'wb') as cache_file:
+            pickle.dump(index, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path) # so other processes never see a partial file
+    except (IOError, OSError):
+        pass # caching is only an optimization
+    return index
+
+_default_rules = None
+
+def default_rules():
+    '''the compiled, indexed 'simplifications', built (or loaded from the
+    cache) the first time they are needed'''
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = load_rules(simplifications)
+    return _default_rules
+
 def make_relation(my_str1, my_str2):  
     '''given a pair of relation strings, will create an object for the relation for easy pattern matching'''
     expr1 = str_to_expr(my_str1)
@@ -332,154 +1019,327 @@ def make_relation(my_str1, my_str2):
     new_rel = Relation(my_str1=my_str1, my_str2=my_str2, operator1=expr1, operator2=expr2, )
     return new_rel
 
-def str_to_expr(mystr):
+# the tokenizer recognizes numeric literals (with an optional exponent, as
+# float folding writes them like 1e-05), names and single-character operators
+_token_re = re.compile(r'\s*(?:((?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|([a-zA-Z_]\w*)|(\S))')
+
+# binding power of each binary operator, and the operators that associate to the right
+_binary_precedence = {'+':1, '-':1, '*':2, '/':2, '^':4}
+_right_associative = ['^']
+_unary_precedence = 3 # so that -x^2 reads as -(x^2), but -x*y as (-x)*y
+_flattened_operators = ['+', '*'] # chains of these become a single n-ary operator
+
+PARSE_CACHE_SIZE = 1024 # number of parsed strings remembered by str_to_expr
+
+def tokenize(mystr):
+    '''given a string, returns a list of (kind, text, position) tokens, where
+    kind is one of 'number', 'name' or 'op'. The string is scanned once.'''
+    tokens = []
+    index = 0
+    length = len(mystr)
+    while index < length:
+        m = _token_re.match(mystr, index)
+        if m.group(1) is not None:
+            tokens.append(('number', m.group(1), m.start(1)))
+        elif m.group(2) is not None:
+            tokens.append(('name', m.group(2), m.start(2)))
+        elif m.group(3) is not None:
+            if m.group(3) not in _binary_precedence and m.group(3) not in '()':
+                raise ValueError("Unexpected character {char!r} at position {pos} in {string!r}".format(
+                    char=m.group(3), pos=m.start(3), string=mystr))
+            tokens.append(('op', m.group(3), m.start(3)))
+        index = m.end()
+    return tokens
+
+def _parse_error(tokens, pos, mystr, expected):
+    if pos < len(tokens):
+        found = "{text!r} at position {pos}".format(text=tokens[pos][1], pos=tokens[pos][2])
+    else:
+        found = "end of input"
+    return ValueError("Expected {expected} but found {found} in {string!r}".format(
+        expected=expected, found=found, string=mystr))
+
+def _negate(operand):
+    '''apply unary minus, folding it into numeric literals'''
+    if isinstance(operand, Variable) and is_numeric(operand.name): # a negative literal
+        if operand.name.startswith('-'):
+            return Variable(operand.name[1:])
+        return Variable('-' + operand.name)
+    return Operator('-', [operand])
+
+def _parse(mystr):
+    '''operator-precedence parsing with explicit stacks, so deeply nested
+    input can't exhaust the recursion limit. The operands are kept as
+    (operator, children) pairs while an unparenthesized chain of + or * is
+    still growing, and as (None, expression) otherwise.'''
+    tokens = tokenize(mystr)
+    operands = []
+    operators = [] # binary operators, 'u-' for unary minus, and '(' markers
+
+    def build(operand):
+        chain_operator, value = operand
+        if chain_operator is None:
+            return value
+        return Operator(chain_operator, value)
+
+    def reduce():
+        operator = operators.pop()
+        if operator == 'u-':
+            operands.append((None, _negate(build(operands.pop()))))
+            return
+        rhs = build(operands.pop())
+        lhs = operands.pop()
+        if operator in _flattened_operators:
+            if lhs[0] == operator: # keep extending the n-ary operator
+                lhs[1].append(rhs)
+                operands.append(lhs)
+            else:
+                operands.append((operator, [build(lhs), rhs]))
+        else:
+            operands.append((None, Operator(operator, [build(lhs), rhs])))
+
+    def precedence(operator):
+        if operator == 'u-':
+            return _unary_precedence
+        return _binary_precedence[operator]
+
+    expect_operand = True
+    for pos, (kind, text, _) in enumerate(tokens):
+        if expect_operand:
+            if kind != 'op':
+                operands.append((None, Variable(text)))
+                expect_operand = False
+            elif text == '(':
+                operators.append('(')
+            elif text == '-':
+                operators.append('u-')
+            elif text != '+': # unary plus does nothing
+                raise _parse_error(tokens, pos, mystr, "an operand")
+        elif kind == 'op' and text in _binary_precedence:
+            my_precedence = _binary_precedence[text]
+            while operators and operators[-1] != '(':
+                top_precedence = precedence(operators[-1])
+                if top_precedence > my_precedence or top_precedence == my_precedence and text not in _right_associative:
+                    reduce()
+                else:
+                    break
+            operators.append(text)
+            expect_operand = True
+        elif text == ')':
+            while operators and operators[-1] != '(':
+                reduce()
+            if not operators:
+                raise _parse_error(tokens, pos, mystr, "an operator")
+            operators.pop()
+            operands.append((None, build(operands.pop()))) # the parentheses only group, they leave no node behind
+        else:
+            raise _parse_error(tokens, pos, mystr, "an operator")
+    if expect_operand:
+        raise _parse_error(tokens, len(tokens), mystr, "an operand")
+    while operators:
+        if operators[-1] == '(':
+            raise _parse_error(tokens, len(tokens), mystr, "')'")
+        reduce()
+    return build(operands.pop())
+
+_cached_parse = functools.lru_cache(maxsize=PARSE_CACHE_SIZE)(_parse)
+
+def set_parse_cache_size(maxsize):
+    '''change the number of strings remembered by str_to_expr. A size of 0
+    turns the cache off, and None makes it unbounded.'''
+    global _cached_parse
+    _cached_parse = functools.lru_cache(maxsize=maxsize)(_parse)
+
+def str_to_expr(mystr, cache=True):
         '''given a string, will parse into a tree of expressions, variables
-           and operators.'''
-        depth = 0
-        branch = '' # a branching out expression
-        index = 0
-        branch_start_index = 0
-        
-        add_sub_spots = []
-        mult_div_spots = []
-        power_spots = []
-        mystr = mystr.strip()
-        for char in mystr: # TODO: Add parenthesis support
-            if char == '(': # opening a branch
-                depth += 1 # traversing deeper into the tree
-                if depth == 1: # get this branch ready for traversal recursively
-                    branch_start_index = index + 1 # the next character starts the branch
-            elif char == ')': # closing a branch
-                depth -= 1 # returning back up it
-                if depth == 0: # then we've closed off the shallowest branch
-                    #branch = mystr[branch_start_index:index]
-                    #print "recursing new branch:", branch
-                    
-                    pass
-            if depth == 0:
-                if char == '+': # then we've hit an add operator
-                    add_sub_spots.append(index)
-                    #branch = mystr[branch_start_index, index]
-                    
-                    #branch_start_index = index + 1
-                elif char == '-':
-                    add_sub_spots.append(-index)
-                elif char == '*':
-                    mult_div_spots.append(index)
-                elif char == '/':
-                    mult_div_spots.append(-index)
-                elif char == '^':
-                    power_spots.append(index)
-                    
-            index += 1
-
-        if add_sub_spots:
-            my_operator = make_operator(mystr, add_sub_spots, '+', '-')
-            return my_operator
-        
-        if mult_div_spots:
-            my_operator = make_operator(mystr, mult_div_spots, '*', '/')
-            return my_operator
+           and operators. The string is tokenized and parsed in one pass;
+           chains of + or * become a single n-ary operator, - and / group
+           to the left and ^ to the right.
+
+           Since expressions are immutable, parsed strings are remembered in a
+           bounded LRU cache keyed on the whitespace-normalized string. Pass
+           cache=False to bypass it.'''
+        if cache:
+            return _cached_parse(' '.join(mystr.split()))
+        return _parse(mystr)
+
+# Derivatives are memoized per (node, variable): since nodes are shared, a
+# subexpression is only ever differentiated once, however many times it is
+# used and however many derivatives are taken. An expression that doesn't
+# depend on the variable always has exactly Variable('0') as its derivative,
+# which also lets the rules below skip such terms.
+_derivative_cache = weakref.WeakKeyDictionary() # node -> {variable: derivative}
+ZERO = Variable('0')
+ONE = Variable('1')
 
-        if power_spots:
-            my_operator = make_operator(mystr, power_spots, '^')
-            return my_operator
+def _sum(terms):
+    terms = [term for term in terms if term is not ZERO]
+    if not terms:
+        return ZERO
+    if len(terms) == 1:
+        return terms[0]
+    return Operator('+', terms)
 
-        return Variable(mystr)
-             
+def _derivative_of_node(expr, x, derivatives):
+    '''differentiate one operator, given the derivatives of its children'''
+    children = expr.children
+    child_derivatives = [derivatives[child] for child in children]
+    if all(derivative is ZERO for derivative in child_derivatives):
+        return ZERO
+    if expr.name == '+':
+        return _sum(child_derivatives)
+    if expr.name == '-': # negation and subtraction are linear too
+        if len(children) == 1:
+            return Operator('-', child_derivatives)
+        subtracted = [derivative for derivative in child_derivatives[1:] if derivative is not ZERO]
+        if not subtracted:
+            return child_derivatives[0]
+        if child_derivatives[0] is ZERO:
+            return Operator('-', [_sum(subtracted)])
+        return Operator('-', [child_derivatives[0]] + subtracted)
+    if expr.name == '*': # the product rule, for any number of factors
+        terms = []
+        for index, derivative in enumerate(child_derivatives):
+            if derivative is not ZERO:
+                terms.append(Operator('*', children[:index] + (derivative,) + children[index + 1:]))
+        return _sum(terms)
+    if expr.name == '/' and len(children) == 2: # the quotient rule
+        numerator, denominator = children
+        d_numerator, d_denominator = child_derivatives
+        if d_denominator is ZERO:
+            return Operator('/', [d_numerator, denominator])
+        return Operator('/', [Operator('-', [Operator('*', [d_numerator, denominator]),
+                                             Operator('*', [numerator, d_denominator])]),
+                              Operator('^', [denominator, Variable('2')])])
+    if expr.name == '^' and len(children) == 2: # the power rule
+        base, exponent = children
+        d_base, d_exponent = child_derivatives
+        if d_exponent is not ZERO:
+            raise ValueError("Can't differentiate {expr} with respect to {x}: the exponent depends on it".format(
+                expr=expr.collapse(), x=x))
+        return Operator('*', [Operator('*', [exponent, d_base]),
+                              Operator('^', [base, Operator('-', [exponent, ONE])])])
+    raise ValueError("Don't know how to differentiate operator {name!r} with {arity} children".format(
+        name=expr.name, arity=len(children)))
 
-def deriv(expr, x):
+def deriv(expr, x, order=1):
     '''Given a function 'func', will compute the first derivative
-      with respect to x.'''
-    
-    if isinstance(expr, Variable): # base case
-        new_var = Variable()
-        #print "found variable:", expr.name
-        if expr.name == x: # if this is the variable
-            new_var.name = "1" # the base case
+      with respect to x, or the derivative of the given order. Results are
+      memoized for every subexpression, so shared subexpressions, repeated
+      calls and each of the lower orders are only differentiated once.'''
+    for i in range(order):
+        derivatives = {} # node -> derivative, for this pass
+        for node in unique_nodes(expr):
+            cached = _derivative_cache.get(node)
+            if cached is not None and x in cached:
+                derivatives[node] = cached[x]
+                continue
+            if isinstance(node, Variable): # base case
+                derivative = ONE if node.name == x else ZERO
+            else:
+                derivative = _derivative_of_node(node, x, derivatives)
+            derivatives[node] = derivative
+            if cached is None:
+                cached = _derivative_cache[node] = {}
+            cached[x] = derivative
+        expr = derivatives[expr]
+    return expr
+
+def clear_caches():
+    '''forget the memoized parses, derivatives and simplifications, for example before timing them'''
+    _cached_parse.cache_clear()
+    _derivative_cache.clear()
+    for index in list(_rule_index_cache.values()) + [_default_rules]:
+        if index is not None:
+            index.clear_cache()
+
+def gradient(expr, variables_list=None):
+    '''returns a dictionary of the partial derivatives of expr with respect to
+    each of the variables (by default, all of them). The derivatives are found
+    together in one reverse-mode pass over the expression: each node passes
+    its adjoint (the derivative of expr with respect to that node) down to its
+    children, and shared subexpressions collect the adjoints of every use
+    before passing theirs on.'''
+    nodes = unique_nodes(expr)
+    depends = {} # node -> the variables it depends on, to skip constant branches
+    for node in nodes:
+        if isinstance(node, Variable):
+            depends[node] = frozenset() if numeric_value(node.name) is not None else frozenset([node.name])
         else:
-            new_var.name = "0"
-        return new_var
-
-    elif isinstance(expr, Operator):
-        new_op = Operator()
-        if expr.name in ['+','-']: # add or subtract
-            #print "found addition"
-            new_op.name = expr.name # same operation
-            for child in expr.children: # loop thru the children
-                #print "descending down the tree after the next branch (addition)"
-                new_child = deriv(child, x) # get the derivatives of the children recursively
-                #print "new_child:", new_child.collapse()
-                #print "adding child to addition operator"
-                new_op.children.append(new_child)
-            
-        if expr.name == '*':
-            #print "found multiplication"
-            new_op.name = '+'
-            new_child1 = Operator('*', [deriv(expr.children[0], x), expr.children[1]])
-            #print "new_child1:", new_child1.collapse()
-            #print "adding child to multiplication operator"
-            new_op.children.append(new_child1)
-            side1 = expr.children[0]
-            #print "side1:", side1.collapse()
-            #print "expr.children[1].collapse():", expr.children[1].collapse()
-            side2 = deriv(expr.children[1], x)
-            #print "side2:", side2.collapse()
-            new_child2 = Operator('*', [side1, side2])
-            #print "new_child2:", new_child2.collapse()
-            #print "adding child to multiplication operator"
-            new_op.children.append(new_child2)
-            
-        if expr.name == '^':
-            #print "found power"
-            new_op.name = '*'
-            #new_child1 = expr.children[1]
-            new_child1 = Operator('*', [expr.children[1], deriv(expr.children[0], x)])
-            #print "new_child1:", new_child1.collapse()
-            new_op.children.append(new_child1)
-            new_child2 = Operator('^', [expr.children[0], Operator('-', [expr.children[1],Variable('1')])])
-            #print "new_child2:", new_child2.collapse()
-            new_op.children.append(new_child2)
-            #new_child3 = deriv(expr.children[0], x)
-            #print "new_child3:", new_child3.collapse()
-            #new_op.children.append(new_child3)
-            
-        return new_op
-    '''
-    m = re.match('^%s$' % x, func)
-    if m:
-        return "1"
-    
-    m = re.match('%s\*\*(\d*\.?\d+)$' % x, func) # if there's a simple exponent expression
-    if m:
-        n = float(m.group(1)) # the value of the exponent
-        n_minus_1 = eval("%d-1" % n)
-        return '%d * %s**%d' % (n, x, n_minus_1)
-    
-    #if not re.search('+',func): # there are no additions in this function
-        
+            depends[node] = frozenset().union(*[depends[child] for child in node.children])
+    if variables_list is None:
+        variables_list = sorted(depends[expr])
+    wanted = frozenset(variables_list)
+
+    contributions = {expr: [ONE]} # node -> the adjoints passed to it by its parents
+    for node in reversed(nodes): # parents come before their children
+        if node not in contributions or isinstance(node, Variable):
+            continue
+        adjoint = _sum(contributions.pop(node))
+        if adjoint is ZERO:
+            continue
+        children = node.children
+        for index, child in enumerate(children):
+            if not depends[child] & wanted:
+                continue
+            if node.name == '+':
+                partial = adjoint
+            elif node.name == '-':
+                partial = adjoint if index == 0 and len(children) > 1 else Operator('-', [adjoint])
+            elif node.name == '*':
+                others = children[:index] + children[index + 1:]
+                if adjoint is not ONE:
+                    others += (adjoint,)
+                partial = others[0] if len(others) == 1 else Operator('*', others)
+            elif node.name == '/' and len(children) == 2:
+                numerator, denominator = children
+                if index == 0:
+                    partial = Operator('/', [adjoint, denominator])
+                else:
+                    partial = Operator('-', [Operator('/', [Operator('*', [adjoint, numerator]),
+                                                            Operator('^', [denominator, Variable('2')])])])
+            elif node.name == '^' and len(children) == 2:
+                base, exponent = children
+                if index == 1:
+                    raise ValueError("Can't differentiate {expr}: the exponent depends on {names}".format(
+                        expr=node.collapse(), names=', '.join(sorted(depends[child] & wanted))))
+                power = Operator('*', [exponent, Operator('^', [base, Operator('-', [exponent, ONE])])])
+                partial = power if adjoint is ONE else Operator('*', [adjoint, power])
+            else:
+                raise ValueError("Don't know how to differentiate operator {name!r} with {arity} children".format(
+                    name=node.name, arity=len(children)))
+            contributions.setdefault(child, []).append(partial)
+
+    result = {}
+    for name in variables_list:
+        result[name] = _sum(contributions.get(Variable(name), []))
+    return result
 
-    # split by additions
-    sum_list = re.split('+', func)
-    for element in sub_list:
-        sub_deriv = deriv(element, x)
-    deriv = " + ".join(sub_deriv)
-    '''
-    return deriv
+def jacobian(exprs, variables_list=None):
+    '''returns the Jacobian of a list of expressions as a list of rows, one
+    per expression, each holding the partial derivatives with respect to the
+    variables (by default, all the variables of all the expressions)'''
+    if variables_list is None:
+        variables_list = sorted(set().union(*[variables(expr) for expr in exprs]))
+    rows = []
+    for expr in exprs:
+        partials = gradient(expr, variables_list)
+        rows.append([partials[name] for name in variables_list])
+    return rows
 
 #print "deriv(test_func)"
 #print deriv(test_func, 'x')
 
-simpl = make_all_relations(simplifications)
+def demo():
+    test_func = "(2 + x*y^3) + x^2"
+    print("test_func:", test_func)
+    func = str_to_expr(test_func)
+    print("func (reprint):", func.collapse())
+    d = deriv(func,'y')
+    print("d:", d.collapse())
+    d = d.simplify()
+    print("d simplified:", d.collapse())
 
-test_func = "(2 + x*y^3) + x^2"
-print "test_func:", test_func
-func = str_to_expr(test_func)
-print "func (reprint):", func.collapse()
-d = deriv(func,'y')
-print "d:", d.collapse()
-d = d.simplify(simpl)
-print "d simplified:", d.collapse()
 #rel = make_relation('a+0', 'a')
 #print "rel.compare(d):", rel.compare(d).collapse()
 
@@ -492,3 +1352,5 @@ print "len(d.children):", len(d.children)
 print "rel.compare(d):", rel.compare(d)
 '''
 
+if __name__ == '__main__':
+    demo()
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+
+'''
+Equality saturation for the expressions in calculus.py
+
+An e-graph stores many equivalent expressions at once. Its e-classes are sets
+of equivalent e-nodes, and an e-node is an operator whose children are
+e-classes rather than expressions. Relations are applied to every match in the
+graph at once, merging the matched class with the class of the rewritten
+expression, until nothing changes (the graph is saturated) or a budget runs
+out. Since rewrites only ever add equalities, rules like commutativity can't
+loop forever: 'a + b' and 'b + a' just end up in the same class.
+
+Sums and products are binarized on the way in, so x + y + z is stored as
+(x + y) + z and the binary rules can match it, with associativity among the
+default rules to regroup them. Each class also carries the exact value of the
+numbers in it, if it has one: whenever every child of an e-node has a value,
+the operator is applied to them and the class is merged with the resulting
+number, so constants fold wherever the rewrites bring them together. A class
+that is a number keeps only its leaf, which also stops rules like 0 * a from
+filling the graph with products that are all zero.
+
+The smallest equivalent expression is then read back out of the graph by
+extract().
+'''
+
+import calculus
+from calculus import Variable, Operator, is_alphabet, numeric_value, number_to_variable
+
+ITERATION_LIMIT = 8 # default number of rewrite rounds
+NODE_LIMIT = 5000 # default number of e-nodes the graph may grow to
+
+associativity = [
+'(a + b) + c', 'a + (b + c)',
+'(a * b) * c', 'a * (b * c)',
+]
+
+def binarize(expr):
+    '''returns expr with every sum, product or difference of more than two
+    operands nested to the left, so a + b + c becomes (a + b) + c'''
+    binary = {} # node -> binarized node
+    for node in calculus.unique_nodes(expr):
+        if isinstance(node, Variable):
+            binary[node] = node
+            continue
+        children = [binary[child] for child in node.children]
+        if node.name in ('+', '*', '-') and len(children) > 2:
+            result = Operator(node.name, children[:2])
+            for child in children[2:]:
+                result = Operator(node.name, [result, child])
+            binary[node] = result
+        else:
+            binary[node] = Operator(node.name, children)
+    return binary[expr]
+
+class EClass(object):
+    '''a set of equivalent e-nodes, the e-nodes that use this class, and
+    the exact value of the class if it is known to be a number'''
+    __slots__ = ('nodes', 'parents', 'value')
+
+    def __init__(self, enode, value=None):
+        self.nodes = set([enode])
+        self.parents = [] # (enode, class id) pairs of the e-nodes with this class as a child
+        self.value = value
+
+class EGraph(object):
+    '''an e-graph with a union-find over class ids and a hashcons from
+    canonical e-nodes to their class. An e-node is a tuple (name, children),
+    where children is a tuple of class ids, or None for a leaf.'''
+    def __init__(self):
+        self._parent = [] # union-find: class id -> parent class id
+        self.classes = {} # canonical class id -> EClass
+        self._hashcons = {} # canonical e-node -> class id
+        self._pending = [] # classes whose parents must be repaired by rebuild()
+
+    def __len__(self):
+        '''the number of e-nodes in the graph'''
+        return len(self._hashcons)
+
+    def find(self, class_id):
+        '''return the canonical id of a class'''
+        root = class_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[class_id] != root: # path compression
+            self._parent[class_id], class_id = root, self._parent[class_id]
+        return root
+
+    def canonicalize(self, enode):
+        name, children = enode
+        if children is None:
+            return enode
+        return (name, tuple(self.find(child) for child in children))
+
+    def add_enode(self, enode):
+        '''add an e-node, returning the id of its class'''
+        enode = self.canonicalize(enode)
+        class_id = self._hashcons.get(enode)
+        if class_id is not None:
+            return self.find(class_id)
+        class_id = len(self._parent)
+        self._parent.append(class_id)
+        if enode[1] is None:
+            value = numeric_value(enode[0])
+        else:
+            value = self._fold(enode)
+        self.classes[class_id] = EClass(enode, value if enode[1] is None else None)
+        self._hashcons[enode] = class_id
+        if enode[1] is not None:
+            for child in enode[1]:
+                self.classes[child].parents.append((enode, class_id))
+            if value is not None:
+                self._set_value(class_id, value)
+        return class_id
+
+    def _fold(self, enode):
+        '''the value of an operator e-node whose children all have values, or
+        None if one doesn't or the result can't be folded'''
+        name, children = enode
+        values = []
+        for child in children:
+            value = self.classes[self.find(child)].value
+            if value is None:
+                return None
+            values.append(value)
+        return calculus._apply_numeric(name, values, True)
+
+    def _set_value(self, class_id, value):
+        '''record that a class is a number, merging it with that number's leaf'''
+        leaf = number_to_variable(value)
+        self.classes[self.find(class_id)].value = value
+        self.merge(class_id, self.add_enode((leaf.name, None)))
+
+    def add(self, expr):
+        '''add an expression, returning the id of its class. Shared
+        subexpressions are only added once.'''
+        expr = binarize(expr)
+        class_ids = {} # node -> class id
+        stack = [(expr, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node in class_ids:
+                continue
+            if isinstance(node, Variable):
+                class_ids[node] = self.add_enode((node.name, None))
+            elif children_done:
+                children = tuple(class_ids[child] for child in node.children)
+                class_ids[node] = self.add_enode((node.name, children))
+            else:
+                stack.append((node, True))
+                for child in node.children:
+                    if child not in class_ids:
+                        stack.append((child, False))
+        return class_ids[expr]
+
+    def merge(self, id1, id2):
+        '''assert that two classes are equivalent. Returns whether anything changed.
+        The graph's invariants are restored by the next call to rebuild().'''
+        id1 = self.find(id1)
+        id2 = self.find(id2)
+        if id1 == id2:
+            return False
+        class1 = self.classes[id1]
+        class2 = self.classes[id2]
+        if len(class1.parents) < len(class2.parents): # keep the larger class as the root
+            id1, id2 = id2, id1
+            class1, class2 = class2, class1
+        self._parent[id2] = id1
+        if class1.value is None:
+            class1.value = class2.value
+        class1.nodes |= class2.nodes
+        class1.parents.extend(class2.parents)
+        del self.classes[id2]
+        self._pending.append(id1)
+        return True
+
+    def rebuild(self):
+        '''restore congruence: e-nodes that became identical after merges are
+        merged too, and the hashcons and classes only hold canonical e-nodes'''
+        while self._pending:
+            todo = set(self.find(class_id) for class_id in self._pending)
+            self._pending = []
+            for class_id in todo:
+                self._repair(self.find(class_id)) # it may have been merged by an earlier repair
+        for class_id, eclass in self.classes.items():
+            if eclass.value is not None: # a number is best written as one, so the rules needn't see the rest
+                eclass.nodes = set(enode for enode in eclass.nodes if enode[1] is None)
+            else:
+                eclass.nodes = set(self.canonicalize(enode) for enode in eclass.nodes)
+
+    def _repair(self, class_id):
+        eclass = self.classes[class_id]
+        for enode, parent_id in eclass.parents:
+            self._hashcons.pop(enode, None)
+            self._hashcons[self.canonicalize(enode)] = self.find(parent_id)
+        new_parents = {}
+        for enode, parent_id in eclass.parents:
+            enode = self.canonicalize(enode)
+            if enode in new_parents:
+                self.merge(parent_id, new_parents[enode])
+            new_parents[enode] = self.find(parent_id)
+        eclass.parents = list(new_parents.items())
+        if eclass.value is not None: # the class may have just become a number
+            for enode, parent_id in eclass.parents:
+                if self.classes[self.find(parent_id)].value is None:
+                    value = self._fold(enode)
+                    if value is not None:
+                        self._set_value(parent_id, value)
+
+    def ematch(self, pattern, class_id, bindings=None):
+        '''yield every binding of the pattern variables to class ids under which
+        the pattern matches the class'''
+        if bindings is None:
+            bindings = {}
+        if isinstance(pattern, Variable):
+            if is_alphabet(pattern.name): # a pattern variable
+                bound = bindings.get(pattern.name)
+                if bound is None:
+                    new_bindings = dict(bindings)
+                    new_bindings[pattern.name] = class_id
+                    yield new_bindings
+                elif bound == class_id:
+                    yield bindings
+            else: # a literal must be in the class
+                leaf_id = self._hashcons.get((pattern.name, None))
+                if leaf_id is not None and self.find(leaf_id) == class_id:
+                    yield bindings
+            return
+        arity = len(pattern.children)
+        for name, children in list(self.classes[class_id].nodes):
+            if name == pattern.name and children is not None and len(children) == arity:
+                for new_bindings in self._match_children(pattern.children, children, 0, bindings):
+                    yield new_bindings
+
+    def _match_children(self, patterns, children, index, bindings):
+        if index == len(patterns):
+            yield bindings
+            return
+        for new_bindings in self.ematch(patterns[index], self.find(children[index]), bindings):
+            for final_bindings in self._match_children(patterns, children, index + 1, new_bindings):
+                yield final_bindings
+
+    def instantiate(self, pattern, bindings):
+        '''add a pattern with its variables replaced by their bound classes,
+        returning the id of its class'''
+        if isinstance(pattern, Variable):
+            if pattern.name in bindings:
+                return self.find(bindings[pattern.name])
+            return self.add_enode((pattern.name, None))
+        children = tuple(self.instantiate(child, bindings) for child in pattern.children)
+        return self.add_enode((pattern.name, children))
+
+    def saturate(self, rules, iteration_limit=ITERATION_LIMIT, node_limit=NODE_LIMIT):
+        '''apply the rules, a list of (lhs, rhs) pattern pairs, to every match in
+        the graph until it is saturated or a budget runs out. Returns why it
+        stopped: 'saturated', 'iteration_limit' or 'node_limit'.'''
+        for iteration in range(iteration_limit):
+            # find all of the matches first, so every rule sees the same graph
+            by_operator = {} # operator name -> ids of classes containing it
+            for class_id, eclass in self.classes.items():
+                for name, children in eclass.nodes:
+                    if children is not None:
+                        by_operator.setdefault(name, set()).add(class_id)
+            matches = []
+            for lhs, rhs in rules:
+                if isinstance(lhs, Operator):
+                    class_ids = by_operator.get(lhs.name, ())
+                else:
+                    class_ids = list(self.classes)
+                for class_id in class_ids:
+                    for bindings in self.ematch(lhs, class_id):
+                        matches.append((class_id, rhs, bindings))
+            changed = False
+            for class_id, rhs, bindings in matches:
+                if len(self) > node_limit:
+                    self.rebuild()
+                    return 'node_limit'
+                if self.merge(class_id, self.instantiate(rhs, bindings)):
+                    changed = True
+            self.rebuild()
+            if not changed:
+                return 'saturated'
+        return 'iteration_limit'
+
+    def extract(self, class_id):
+        '''return the smallest expression (by number of nodes) in a class'''
+        best = {} # class id -> (cost, e-node)
+        changed = True
+        while changed: # costs only go down, so this reaches a fixed point
+            changed = False
+            for eclass_id, eclass in self.classes.items():
+                for enode in eclass.nodes:
+                    cost = self._cost(enode, best)
+                    if cost is None: # a child has no expression yet
+                        continue
+                    if eclass_id not in best or cost < best[eclass_id][0]:
+                        best[eclass_id] = (cost, enode)
+                        changed = True
+
+        exprs = {} # class id -> extracted expression
+        stack = [(self.find(class_id), False)]
+        while stack:
+            current, children_done = stack.pop()
+            if current in exprs:
+                continue
+            name, children = best[current][1]
+            if children is None:
+                exprs[current] = Variable(name)
+            elif children_done:
+                exprs[current] = Operator(name, [exprs[self.find(child)] for child in children])
+            else:
+                stack.append((current, True))
+                for child in children:
+                    stack.append((self.find(child), False))
+        return exprs[self.find(class_id)]
+
+    def _cost(self, enode, best):
+        '''the size of the smallest expression for an e-node, given the best
+        known costs of the classes, or None if a child has no cost yet'''
+        name, children = enode
+        cost = 1
+        if children is not None:
+            for child in children:
+                child_best = best.get(self.find(child))
+                if child_best is None:
+                    return None
+                cost += child_best[0]
+        return cost
+
+def relation_rules(relations, both_ways=False):
+    '''turn Relation objects into (lhs, rhs) rules. With both_ways, each
+    relation is also used right to left, as long as every variable on its
+    LHS also appears on its RHS.'''
+    rules = []
+    for relation in relations:
+        lhs = binarize(relation.operator1)
+        rhs = binarize(relation.operator2)
+        rules.append((lhs, rhs))
+        if both_ways:
+            lhs_variables = set(leaf.name for leaf in calculus._pattern_leaves(lhs))
+            rhs_variables = set(leaf.name for leaf in calculus._pattern_leaves(rhs))
+            if lhs_variables <= rhs_variables:
+                rules.append((rhs, lhs))
+    return rules
+
+_default_rules = None
+
+def default_rules():
+    '''the laws of algebra and associativity, used both ways, and the
+    simplifications from calculus.py'''
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = relation_rules(calculus.make_all_relations(calculus.laws_of_algebra + associativity), both_ways=True) \
+            + relation_rules(calculus.make_all_relations(calculus.simplifications))
+    return _default_rules
+
+def saturate(expr, rules=None, iteration_limit=ITERATION_LIMIT, node_limit=NODE_LIMIT):
+    '''simplify an expression by equality saturation, returning the smallest
+    equivalent expression found within the budgets. The rules default to
+    default_rules().'''
+    if rules is None:
+        rules = default_rules()
+    graph = EGraph()
+    root = graph.add(expr)
+    graph.saturate(rules, iteration_limit=iteration_limit, node_limit=node_limit)
+    return graph.extract(root)
@@ -0,0 +1,215 @@
+#!/usr/bin/python
+
+'''
+Numerical evaluation of the expressions in calculus.py
+
+lambdify() compiles a Variable/Operator tree into Python source, one
+assignment per distinct subexpression, so shared subexpressions are only
+evaluated once. The compiled function works on plain numbers, and on NumPy
+arrays when NumPy is installed, since it only uses arithmetic operators.
+
+IncrementalEvaluator is for evaluating one expression many times while only
+a few variables change, as in a parameter sweep: it keeps the value of every
+node, and after set() only the nodes that depend on the changed variables
+are recomputed.
+'''
+
+import weakref
+from fractions import Fraction
+
+from calculus import Variable, apply_operator, numeric_value, variables, unique_nodes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_python_operators = {'+':' + ', '*':' * ', '-':' - ', '/':' / ', '^':' ** '}
+
+class CompiledExpression(object):
+    '''a callable compiled from an expression. Arguments may be given by
+    position, in the order of 'args', or by variable name. Lists, tuples and
+    arrays are turned into float NumPy arrays, so the evaluation is vectorized.'''
+    def __init__(self, expr, args):
+        self.args = tuple(args)
+        self.source = _expression_source(expr, self.args)
+        self.code = compile(self.source, '<lambdified {expr}>'.format(expr=expr.collapse()[:60]), 'exec')
+        namespace = {}
+        exec(self.code, namespace)
+        self.function = namespace['f']
+        self._positions = dict((name, index) for index, name in enumerate(self.args))
+
+    def __call__(self, *values, **named_values):
+        if named_values:
+            values = list(values) + [None] * (len(self.args) - len(values))
+            for name, value in named_values.items():
+                if name not in self._positions:
+                    raise TypeError("Unexpected variable {name!r}; the arguments are {args}".format(
+                        name=name, args=self.args))
+                values[self._positions[name]] = value
+        if len(values) != len(self.args) or any(value is None for value in values): # not 'None in values', which compares arrays
+            raise TypeError("Expected values for {args}".format(args=self.args))
+        if numpy is not None:
+            values = [numpy.asarray(value, dtype=float) if isinstance(value, (list, tuple, numpy.ndarray)) else value
+                      for value in values]
+        return self.function(*values)
+
+def _expression_source(expr, args):
+    '''write the source of a function 'f' that evaluates expr, taking the
+    variables in args as its parameters'''
+    names = {} # node -> Python expression for its value
+    for index, name in enumerate(args):
+        names[Variable(name)] = 'v{n}'.format(n=index)
+    lines = []
+    for node in unique_nodes(expr):
+        if node in names:
+            continue
+        if isinstance(node, Variable):
+            value = numeric_value(node.name)
+            if value is None:
+                raise ValueError("No argument given for variable {name!r}".format(name=node.name))
+            value = int(value) if value.denominator == 1 else float(value) # no Fractions in the source
+            names[node] = '(' + repr(value) + ')'
+            continue
+        if node.name not in _python_operators:
+            raise ValueError("Can't evaluate operator {name!r}".format(name=node.name))
+        children = [names[child] for child in node.children]
+        if len(children) == 1:
+            if node.name != '-':
+                raise ValueError("Can't evaluate unary operator {name!r}".format(name=node.name))
+            value = '-' + children[0]
+        else:
+            value = _python_operators[node.name].join(children)
+        temp = 't{n}'.format(n=len(lines))
+        lines.append('    {temp} = {value}\n'.format(temp=temp, value=value))
+        names[node] = temp
+    params = ', '.join('v{n}'.format(n=index) for index in range(len(args)))
+    return 'def f({params}):\n{body}    return {result}\n'.format(params=params, body=''.join(lines), result=names[expr])
+
+_compiled = weakref.WeakKeyDictionary() # expr -> {args: CompiledExpression}
+
+def lambdify(expr, args=None):
+    '''compile an expression into a CompiledExpression. 'args' lists the
+    variable names in positional order, and defaults to all of the
+    expression's variables in sorted order. The compiled callable is cached
+    per expression and argument order.'''
+    if args is None:
+        args = sorted(variables(expr))
+    args = tuple(args)
+    by_args = _compiled.get(expr)
+    if by_args is None:
+        by_args = {}
+        _compiled[expr] = by_args
+    compiled = by_args.get(args)
+    if compiled is None:
+        compiled = CompiledExpression(expr, args)
+        by_args[args] = compiled
+    return compiled
+
+class IncrementalEvaluator(object):
+    '''the value of an expression, kept up to date as its variables change.
+    The value of every distinct node is cached, and each variable knows which
+    nodes depend on it, so set() only marks those nodes as stale; they are
+    recomputed, children first, the next time a value is asked for. Several
+    set() or update() calls in a row are therefore batched into one
+    recomputation.
+
+    With exact=True, values are Fractions (floats given as values are
+    converted exactly), and a power with a non-integer exponent raises
+    ValueError. Otherwise values are floats.'''
+    def __init__(self, expr, values=None, exact=False):
+        self.expr = expr
+        self.exact = exact
+        self._nodes = unique_nodes(expr) # children before parents
+        position = dict((node, index) for index, node in enumerate(self._nodes))
+        self._position = position
+        self._children = [None if isinstance(node, Variable) else [position[child] for child in node.children]
+                          for node in self._nodes]
+        self._values = [None] * len(self._nodes)
+        self._variables = {} # variable name -> position of its leaf
+        parents = [[] for node in self._nodes]
+        for index, node in enumerate(self._nodes):
+            if isinstance(node, Variable):
+                value = numeric_value(node.name)
+                if value is None:
+                    self._variables[node.name] = index
+                else:
+                    self._values[index] = self._convert(value)
+            else:
+                for child in set(self._children[index]):
+                    parents[child].append(index)
+        # the operator nodes above each variable, in postorder
+        self._dependents = {}
+        for name, leaf in self._variables.items():
+            seen = set()
+            stack = [leaf]
+            while stack:
+                for parent in parents[stack.pop()]:
+                    if parent not in seen:
+                        seen.add(parent)
+                        stack.append(parent)
+            self._dependents[name] = sorted(seen)
+        self._unbound = set(self._variables) # the variables without a value yet
+        self._stale = set(index for index, children in enumerate(self._children) if children is not None)
+        if values:
+            self.update(values)
+
+    def _convert(self, value):
+        if self.exact:
+            return value if isinstance(value, Fraction) else Fraction(value)
+        return float(value)
+
+    @property
+    def variables(self):
+        '''the names of the variables of the expression'''
+        return sorted(self._variables)
+
+    def set(self, name, value):
+        '''give a variable a new value'''
+        leaf = self._variables.get(name)
+        if leaf is None:
+            raise KeyError("{name!r} is not a variable of the expression".format(name=name))
+        value = self._convert(value)
+        if value == self._values[leaf] and type(value) is type(self._values[leaf]):
+            return
+        self._values[leaf] = value
+        self._unbound.discard(name)
+        self._stale.update(self._dependents[name])
+
+    def update(self, values):
+        '''give several variables new values, from a dictionary'''
+        for name, value in values.items():
+            self.set(name, value)
+
+    def get(self, name):
+        '''the current value of a variable, or None if it has none yet'''
+        if name not in self._variables:
+            raise KeyError("{name!r} is not a variable of the expression".format(name=name))
+        return self._values[self._variables[name]]
+
+    def _recompute(self):
+        if self._unbound: # checked even when nothing is stale, as for a lone variable
+            raise ValueError("No value given for variable(s) {names}".format(names=', '.join(sorted(self._unbound))))
+        if not self._stale:
+            return
+        values = self._values
+        for index in sorted(self._stale):
+            values[index] = apply_operator(self._nodes[index].name,
+                                            [values[child] for child in self._children[index]], self.exact)
+        self._stale.clear()
+
+    def value(self, node=None):
+        '''the value of the expression, or of one of its subexpressions'''
+        self._recompute()
+        if node is None:
+            return self._values[-1]
+        if node not in self._position:
+            raise KeyError("{node} is not a subexpression of the expression".format(node=node.collapse()))
+        return self._values[self._position[node]]
+
+    def sweep(self, name, values):
+        '''yield the value of the expression for each value of one variable,
+        leaving the others as they are'''
+        for value in values:
+            self.set(name, value)
+            yield self.value()
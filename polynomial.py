@@ -0,0 +1,249 @@
+#!/usr/bin/python
+
+'''
+Sparse multivariate polynomials with exact coefficients
+
+A Polynomial maps monomials to coefficients: each monomial is a tuple of
+exponents, one per variable in the polynomial's sorted tuple of variable
+names, and each coefficient is an integer or a Fraction. Like terms are
+combined as they are created and zero terms are dropped, so two polynomials
+are equal exactly when their dictionaries are, and x*y + y*x is just 2*x*y.
+
+Polynomial.from_expr() converts a Variable/Operator tree, and to_expr()
+converts back, with the terms in a canonical order: highest total degree
+first, then lexicographically by exponent.
+'''
+
+from fractions import Fraction
+
+import calculus
+from calculus import Variable, Operator, numeric_value, number_to_variable, unique_nodes
+
+class NotPolynomialError(ValueError):
+    '''raised when an expression can't be written as a polynomial'''
+    pass
+
+class Polynomial(object):
+    __slots__ = ('variables', 'terms')
+
+    def __init__(self, terms=None, variables=()):
+        self.variables = tuple(variables)
+        self.terms = {}
+        if terms:
+            for monomial, coefficient in terms.items():
+                if coefficient != 0:
+                    self.terms[tuple(monomial)] = coefficient
+
+    @classmethod
+    def constant(cls, value, variables=()):
+        return cls({(0,) * len(variables): value}, variables)
+
+    @classmethod
+    def variable(cls, name):
+        return cls({(1,): 1}, (name,))
+
+    def __repr__(self):
+        return 'Polynomial({terms!r}, {variables!r})'.format(terms=self.terms, variables=self.variables)
+
+    def _extend(self, variables):
+        '''the terms rewritten over a sorted superset of this polynomial's variables'''
+        if variables == self.variables:
+            return self.terms
+        positions = [variables.index(name) for name in self.variables]
+        terms = {}
+        for monomial, coefficient in self.terms.items():
+            exponents = [0] * len(variables)
+            for position, exponent in zip(positions, monomial):
+                exponents[position] = exponent
+            terms[tuple(exponents)] = coefficient
+        return terms
+
+    def _align(self, other):
+        '''the common variables, and both polynomials' terms over them'''
+        if not isinstance(other, Polynomial):
+            other = Polynomial.constant(other, self.variables)
+        if other.variables == self.variables:
+            return self.variables, self.terms, other.terms
+        variables = tuple(sorted(set(self.variables) | set(other.variables)))
+        return variables, self._extend(variables), other._extend(variables)
+
+    def _support(self):
+        '''the terms with the unused variables left out, for comparing and hashing'''
+        return frozenset((frozenset((name, exponent) for name, exponent in zip(self.variables, monomial) if exponent),
+                          coefficient) for monomial, coefficient in self.terms.items())
+
+    def __eq__(self, other):
+        if not isinstance(other, Polynomial):
+            if isinstance(other, (int, Fraction)):
+                other = Polynomial.constant(other)
+            else:
+                return NotImplemented
+        variables, terms1, terms2 = self._align(other)
+        return terms1 == terms2
+
+    def __hash__(self):
+        return hash(self._support())
+
+    def __add__(self, other):
+        variables, terms1, terms2 = self._align(other)
+        terms = dict(terms1)
+        for monomial, coefficient in terms2.items():
+            terms[monomial] = terms.get(monomial, 0) + coefficient
+        return Polynomial(terms, variables)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return Polynomial(dict((monomial, -coefficient) for monomial, coefficient in self.terms.items()), self.variables)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, other):
+        variables, terms1, terms2 = self._align(other)
+        terms = {}
+        for monomial1, coefficient1 in terms1.items():
+            for monomial2, coefficient2 in terms2.items():
+                monomial = tuple(exponent1 + exponent2 for exponent1, exponent2 in zip(monomial1, monomial2))
+                terms[monomial] = terms.get(monomial, 0) + coefficient1 * coefficient2
+        return Polynomial(terms, variables)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        '''division by a non-zero constant'''
+        return Polynomial(dict((monomial, Fraction(coefficient) / other) for monomial, coefficient in self.terms.items()),
+                          self.variables)
+
+    def __pow__(self, exponent):
+        if not isinstance(exponent, int) or exponent < 0:
+            raise NotPolynomialError("Polynomials can only be raised to non-negative integer powers, not {exponent!r}".format(
+                exponent=exponent))
+        result = Polynomial.constant(1, self.variables)
+        square = self
+        while exponent: # exponentiation by squaring
+            if exponent & 1:
+                result = result * square
+            exponent >>= 1
+            if exponent:
+                square = square * square
+        return result
+
+    def degree(self):
+        '''the total degree, or -1 for the zero polynomial'''
+        return max([sum(monomial) for monomial in self.terms] or [-1])
+
+    def derive(self, name):
+        '''the partial derivative with respect to a variable'''
+        if name not in self.variables:
+            return Polynomial({}, self.variables)
+        position = self.variables.index(name)
+        terms = {}
+        for monomial, coefficient in self.terms.items():
+            exponent = monomial[position]
+            if exponent:
+                new_monomial = monomial[:position] + (exponent - 1,) + monomial[position + 1:]
+                terms[new_monomial] = coefficient * exponent
+        return Polynomial(terms, self.variables)
+
+    def sorted_terms(self):
+        '''the (monomial, coefficient) pairs in canonical order'''
+        return sorted(self.terms.items(), key=lambda term: (-sum(term[0]), tuple(-exponent for exponent in term[0])))
+
+    def to_expr(self):
+        '''convert to an Operator tree: an n-ary sum of products, in canonical order'''
+        summands = []
+        for monomial, coefficient in self.sorted_terms():
+            factors = []
+            if coefficient != 1 or not any(monomial):
+                factors.append(number_to_variable(coefficient))
+            for name, exponent in zip(self.variables, monomial):
+                if exponent == 1:
+                    factors.append(Variable(name))
+                elif exponent:
+                    factors.append(Operator('^', [Variable(name), Variable(str(exponent))]))
+            summands.append(factors[0] if len(factors) == 1 else Operator('*', factors))
+        if not summands:
+            return Variable('0')
+        if len(summands) == 1:
+            return summands[0]
+        return Operator('+', summands)
+
+    @classmethod
+    def from_expr(cls, expr):
+        '''convert an expression into a polynomial, raising NotPolynomialError
+        if it uses anything but sums, differences, products, division by
+        constants and non-negative integer powers'''
+        polynomials = {} # node -> Polynomial, so shared subexpressions are converted once
+        for node in unique_nodes(expr):
+            if isinstance(node, Variable):
+                value = numeric_value(node.name)
+                if value is not None:
+                    polynomials[node] = cls.constant(value)
+                elif calculus.is_alphabet(node.name):
+                    polynomials[node] = cls.variable(node.name)
+                else:
+                    raise NotPolynomialError("Can't read {name!r} as a polynomial".format(name=node.name))
+                continue
+            children = [polynomials[child] for child in node.children]
+            if node.name == '+':
+                result = children[0]
+                for child in children[1:]:
+                    result = result + child
+            elif node.name == '*':
+                result = children[0]
+                for child in children[1:]:
+                    result = result * child
+            elif node.name == '-':
+                if len(children) == 1:
+                    result = -children[0]
+                else:
+                    result = children[0]
+                    for child in children[1:]:
+                        result = result - child
+            elif node.name == '/' and len(children) == 2:
+                divisor = children[1]._constant_value()
+                if divisor is None or divisor == 0:
+                    raise NotPolynomialError("Can't divide by {expr}".format(expr=node.children[1].collapse()))
+                result = children[0] / divisor
+            elif node.name == '^' and len(children) == 2:
+                exponent = children[1]._constant_value()
+                if exponent is None or Fraction(exponent).denominator != 1 or exponent < 0:
+                    raise NotPolynomialError("Can't raise to the power {expr}".format(expr=node.children[1].collapse()))
+                result = children[0] ** int(exponent)
+            else:
+                raise NotPolynomialError("Can't read operator {name!r} as a polynomial".format(name=node.name))
+            polynomials[node] = result
+        return polynomials[expr]
+
+    def _constant_value(self):
+        '''the value of a constant polynomial, or None if it isn't constant'''
+        if not self.terms:
+            return 0
+        if len(self.terms) == 1:
+            monomial, coefficient = next(iter(self.terms.items()))
+            if not any(monomial):
+                return coefficient
+        return None
+
+def to_polynomial(expr):
+    '''returns the Polynomial for an expression, or None if it isn't one'''
+    try:
+        return Polynomial.from_expr(expr)
+    except NotPolynomialError:
+        return None
+
+def canonicalize(expr, simplifications=None):
+    '''returns the canonical form of a polynomial expression, with like terms
+    combined. Other expressions are flattened and, if a list of relations is
+    given, simplified with them instead.'''
+    polynomial = to_polynomial(expr)
+    if polynomial is not None:
+        return polynomial.to_expr()
+    expr = calculus.flatten(expr)
+    if simplifications is not None:
+        expr = expr.simplify(simplifications)
+    return expr
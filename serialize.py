@@ -0,0 +1,220 @@
+#!/usr/bin/python
+
+'''
+A compact binary format for corpora of expressions, loaded with mmap
+
+The expressions in a corpus are stored together as one DAG: every distinct
+node is written once, children before parents, so subexpressions shared
+within or between expressions cost nothing extra. Names are interned in a
+symbol table, and the nodes are held in flat columns of little-endian 32-bit
+integers:
+
+    header          magic b'SYMX', format version, and the counts below
+    symbol offsets  n_symbols + 1 byte offsets into the symbol data
+    symbol data     the UTF-8 names, padded to 4 bytes
+    node symbols    n_nodes symbol ids; the top bit marks an Operator
+    child starts    n_nodes + 1 offsets into the children column
+    children        n_children node ids
+    roots           n_roots node ids, one per expression
+
+Corpus opens a file with mmap and reads the columns in place, so getting one
+expression only touches the nodes it is made of, however big the file is.
+'''
+
+import array
+import mmap
+import struct
+import sys
+import weakref
+
+from calculus import Variable, Operator, unique_nodes
+
+MAGIC = b'SYMX'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<4sIIIIII') # magic, version, symbols, symbol bytes, nodes, children, roots
+_OPERATOR_FLAG = 0x80000000
+
+def _column(values=()):
+    column = array.array('I', values)
+    assert column.itemsize == 4, "array 'I' must be 32 bits"
+    return column
+
+def _little_endian_bytes(column):
+    if sys.byteorder == 'big':
+        column = _column(column)
+        column.byteswap()
+    return column.tobytes()
+
+def _padding(length):
+    return b'\0' * (-length % 4)
+
+def dumps(exprs):
+    '''returns the binary form of a list of expressions'''
+    symbols = {} # name -> symbol id
+    node_ids = {} # node -> node id
+    node_symbols = _column()
+    child_starts = _column([0])
+    children = _column()
+    roots = _column()
+    for expr in exprs:
+        for node in unique_nodes(expr):
+            if node in node_ids:
+                continue
+            symbol = symbols.get(node.name)
+            if symbol is None:
+                symbol = symbols[node.name] = len(symbols)
+            if isinstance(node, Operator):
+                node_symbols.append(symbol | _OPERATOR_FLAG)
+                children.extend(node_ids[child] for child in node.children)
+            else:
+                node_symbols.append(symbol)
+            child_starts.append(len(children))
+            node_ids[node] = len(node_ids)
+        roots.append(node_ids[expr])
+
+    names = sorted(symbols, key=symbols.get)
+    encoded = [name.encode('utf-8') for name in names]
+    symbol_offsets = _column([0])
+    for name in encoded:
+        symbol_offsets.append(symbol_offsets[-1] + len(name))
+    symbol_data = b''.join(encoded)
+    return b''.join([
+        _HEADER.pack(MAGIC, FORMAT_VERSION, len(names), len(symbol_data), len(node_symbols), len(children), len(roots)),
+        _little_endian_bytes(symbol_offsets),
+        symbol_data, _padding(len(symbol_data)),
+        _little_endian_bytes(node_symbols),
+        _little_endian_bytes(child_starts),
+        _little_endian_bytes(children),
+        _little_endian_bytes(roots),
+    ])
+
+def dump(exprs, path):
+    '''write a list of expressions to a corpus file'''
+    with open(path, 'wb') as corpus_file:
+        corpus_file.write(dumps(exprs))
+
+class Corpus(object):
+    '''a read-only corpus of expressions, from a file (opened with mmap) or
+    from bytes. Expressions are built on demand: corpus[i] only reads the
+    nodes of the i-th expression, and nodes already built are reused while
+    they are alive.'''
+    def __init__(self, source):
+        self._file = None
+        self._mmap = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = memoryview(source)
+        else:
+            self._file = open(source, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = memoryview(self._mmap)
+        self._buffer = buffer
+        if len(buffer) < _HEADER.size:
+            raise ValueError("Not an expression corpus: too short")
+        magic, version, n_symbols, symbol_bytes, n_nodes, n_children, n_roots = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an expression corpus: bad magic number {magic!r}".format(magic=magic))
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported corpus format version {version}".format(version=version))
+        offset = _HEADER.size
+        self._symbol_offsets, offset = self._read_column(offset, n_symbols + 1)
+        self._symbol_data = buffer[offset:offset + symbol_bytes]
+        offset += symbol_bytes + len(_padding(symbol_bytes))
+        self._node_symbols, offset = self._read_column(offset, n_nodes)
+        self._child_starts, offset = self._read_column(offset, n_nodes + 1)
+        self._children, offset = self._read_column(offset, n_children)
+        self._roots, offset = self._read_column(offset, n_roots)
+        if offset > len(buffer):
+            raise ValueError("Truncated expression corpus")
+        self._names = {} # symbol id -> name
+        self._nodes = weakref.WeakValueDictionary() # node id -> node
+
+    def _read_column(self, offset, count):
+        end = offset + 4 * count
+        column = self._buffer[offset:end].cast('I') # no copy
+        if sys.byteorder == 'big':
+            column = _column(column)
+            column.byteswap()
+        return column, end
+
+    def __len__(self):
+        return len(self._roots)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self._roots)
+        if not 0 <= index < len(self._roots):
+            raise IndexError("corpus index out of range")
+        return self._materialize(self._roots[index])
+
+    def __iter__(self):
+        for index in range(len(self._roots)):
+            yield self[index]
+
+    def _name(self, symbol):
+        name = self._names.get(symbol)
+        if name is None:
+            start = self._symbol_offsets[symbol]
+            name = self._names[symbol] = self._symbol_data[start:self._symbol_offsets[symbol + 1]].tobytes().decode('utf-8')
+        return name
+
+    def _materialize(self, root):
+        '''build the node with the given id, and any of its descendants not built yet'''
+        built = {} # node id -> node, holding on to them until the root is built
+        stack = [(root, False)]
+        while stack:
+            node_id, children_done = stack.pop()
+            if node_id in built:
+                continue
+            node = self._nodes.get(node_id)
+            if node is not None:
+                built[node_id] = node
+                continue
+            symbol = self._node_symbols[node_id]
+            if not symbol & _OPERATOR_FLAG:
+                node = Variable(self._name(symbol))
+            else:
+                child_ids = self._children[self._child_starts[node_id]:self._child_starts[node_id + 1]]
+                if not children_done:
+                    stack.append((node_id, True))
+                    stack.extend((child_id, False) for child_id in child_ids if child_id not in built)
+                    continue
+                node = Operator(self._name(symbol & ~_OPERATOR_FLAG), [built[child_id] for child_id in child_ids])
+            built[node_id] = node
+            self._nodes[node_id] = node
+        return built[root]
+
+    def close(self):
+        '''release the mapped file. Expressions already built stay valid.'''
+        for column in ('_symbol_offsets', '_node_symbols', '_child_starts', '_children', '_roots'):
+            value = getattr(self, column, None)
+            if isinstance(value, memoryview):
+                value.release()
+        if getattr(self, '_symbol_data', None) is not None:
+            self._symbol_data.release()
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def loads(data):
+    '''returns the list of expressions in the binary form made by dumps()'''
+    corpus = Corpus(data)
+    try:
+        return list(corpus)
+    finally:
+        corpus.close()
+
+def load(path):
+    '''open a corpus file. Use it as a context manager, or close() it when done.'''
+    return Corpus(path)
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+
+'''
+A local expression service: parse, differentiate, simplify and evaluate over
+a Unix socket or a localhost TCP port
+
+Clients send one request per line as JSON (or as a stream of msgpack maps
+with --protocol msgpack, if msgpack is installed), like
+
+    {"id": 1, "op": "deriv", "expr": "x^2*y", "wrt": "x"}
+
+and get back one response per request, in the order they complete:
+
+    {"id": 1, "result": "((2*x)*y)", "error": null, "cached": false}
+
+The operations are
+
+    parse      the canonical form of the expression
+    deriv      the derivative with respect to 'wrt', of the given 'order'
+               (default 1), simplified unless "simplify" is false
+    simplify   the simplified expression
+    evaluate   the value of the expression, given the variables' 'values'
+    metrics    counters, cache hit rate and latencies of the server
+
+Expressions are parsed in the server, and since nodes are hash-consed, the
+parsed expression is its own canonical key: results are kept in a bounded
+LRU cache keyed on the operation, the expression and its parameters
+(including the types of the values), shared by every client. Errors are not
+cached. Identical requests already in flight wait for the same result
+instead of being computed twice. The rest are collected for a few
+milliseconds into batches and sent to a pool of worker processes, which
+load the rule set once when they start.
+
+usage: python server.py [--socket PATH | --host HOST --port PORT] [--workers N]
+                        [--cache-size N] [--batch-size N] [--batch-delay SECONDS]
+                        [--protocol jsonl|msgpack]
+'''
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import calculus
+from evaluate import lambdify
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CACHE_SIZE = 4096 # results kept in the LRU cache
+BATCH_SIZE = 64 # most requests sent to a worker at a time
+BATCH_DELAY = 0.002 # seconds to wait for more requests before sending a batch
+LATENCY_WINDOW = 1000 # latencies kept for the metrics, per operation
+
+OPERATIONS = ['parse', 'deriv', 'simplify', 'evaluate']
+
+def _compute(op, text, params):
+    '''do one operation on the canonical text of an expression'''
+    expr = calculus.str_to_expr(text)
+    if op == 'deriv':
+        wrt, order, simplify = params
+        expr = calculus.deriv(expr, wrt, order)
+        if simplify:
+            expr = expr.simplify(calculus.default_rules())
+        return expr.collapse()
+    if op == 'simplify':
+        return expr.simplify(calculus.default_rules()).collapse()
+    if op == 'evaluate':
+        value = lambdify(expr)(**dict((name, value) for name, kind, value in params))
+        if isinstance(value, complex) or isinstance(value, float) and not math.isfinite(value):
+            raise ValueError("The value {value} is not a finite real number".format(value=value))
+        return value
+    raise ValueError("Unknown operation {op!r}".format(op=op))
+
+def _compute_batch(tasks):
+    '''do a list of (op, text, params) operations, returning a (result, error)
+    pair for each, so one failure doesn't fail the batch'''
+    results = []
+    for op, text, params in tasks:
+        try:
+            results.append((_compute(op, text, params), None))
+        except Exception as error:
+            results.append((None, '{kind}: {message}'.format(kind=type(error).__name__, message=error)))
+    return results
+
+class LRUCache(object):
+    '''a dictionary holding at most 'maxsize' items, dropping the least recently used'''
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        try:
+            value = self._items[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+class ExpressionServer(object):
+    '''the request handling of the service: caching, coalescing and batching
+    in front of a process pool. With workers=0, the work is done in the
+    server's process.'''
+    def __init__(self, workers=None, cache_size=CACHE_SIZE, batch_size=BATCH_SIZE, batch_delay=BATCH_DELAY):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=calculus.default_rules) if workers else None
+        self.cache = LRUCache(cache_size)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._in_flight = {} # cache key -> future of its (result, error)
+        self._queue = [] # (task, future) pairs waiting to be sent
+        self._flush_handle = None
+        self.counters = collections.Counter()
+        self.latencies = dict((op, collections.deque(maxlen=LATENCY_WINDOW)) for op in OPERATIONS)
+        self.started = time.time()
+
+    async def handle(self, request):
+        '''returns the response to one request dictionary'''
+        start = time.perf_counter()
+        response = {'id': request.get('id') if isinstance(request, dict) else None,
+                    'result': None, 'error': None, 'cached': False}
+        op = None
+        try:
+            if not isinstance(request, dict):
+                raise ValueError("Expected an object with an 'op' field")
+            op = request.get('op')
+            if op == 'metrics':
+                response['result'] = self.metrics()
+                return response
+            if op not in OPERATIONS:
+                op = None
+                raise ValueError("Unknown operation {op!r}; expected one of {ops}".format(
+                    op=request.get('op'), ops=', '.join(OPERATIONS + ['metrics'])))
+            self.counters['requests'] += 1
+            expr = calculus.str_to_expr(request['expr'])
+            if op == 'parse':
+                response['result'] = expr.collapse()
+                return response
+            params = self._params(op, request)
+            key = (op, expr, params)
+            cached = self.cache.get(key)
+            if cached is not None:
+                response['cached'] = True
+            else:
+                future = self._in_flight.get(key)
+                if future is not None:
+                    self.counters['coalesced'] += 1
+                else:
+                    future = self._in_flight[key] = self._submit((op, expr.collapse(), params))
+                    future.add_done_callback(lambda done, key=key: self._finish(key, done))
+                cached = await asyncio.shield(future)
+            response['result'], response['error'] = cached
+        except Exception as error:
+            response['error'] = '{kind}: {message}'.format(kind=type(error).__name__, message=error)
+        finally:
+            if response['error'] is not None:
+                self.counters['errors'] += 1
+            if op in self.latencies:
+                self.latencies[op].append(time.perf_counter() - start)
+        return response
+
+    def _params(self, op, request):
+        '''the parameters of a request that its result depends on, as a hashable tuple'''
+        if op == 'deriv':
+            order = request.get('order', 1)
+            if not isinstance(order, int) or order < 0:
+                raise ValueError("'order' must be a non-negative integer")
+            return (request['wrt'], order, bool(request.get('simplify', True)))
+        if op == 'evaluate':
+            values = request.get('values', {})
+            if not isinstance(values, dict) or not all(isinstance(value, (int, float)) and not isinstance(value, bool)
+                                                       for value in values.values()):
+                raise ValueError("'values' must be an object mapping variables to numbers")
+            # the type is part of the key, since 1 == 1.0 but x^1000 overflows for x=10.0 and not for x=10
+            return tuple(sorted((name, type(value).__name__, value) for name, value in values.items()))
+        return ()
+
+    def _finish(self, key, future):
+        del self._in_flight[key]
+        if not future.cancelled() and future.exception() is None and future.result()[1] is None:
+            self.cache.put(key, future.result()) # errors aren't cached, in case they were transient
+
+    def _submit(self, task):
+        '''queue a task for the next batch, returning the future of its (result, error)'''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((task, future))
+        if len(self._queue) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_delay, self._flush)
+        return future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if not batch:
+            return
+        self.counters['batches'] += 1
+        self.counters['computed'] += len(batch)
+        tasks = [task for task, future in batch]
+        futures = [future for task, future in batch]
+        if self.executor is None:
+            self._resolve(futures, _compute_batch(tasks))
+            return
+        done = asyncio.get_running_loop().run_in_executor(self.executor, _compute_batch, tasks)
+        done.add_done_callback(lambda done: self._resolve(futures, done.result()) if done.exception() is None
+                               else self._fail(futures, done.exception()))
+
+    def _resolve(self, futures, results):
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, futures, error):
+        for future in futures:
+            if not future.done():
+                future.set_exception(error)
+
+    def metrics(self):
+        '''returns the counters, cache hit rate and latencies (in milliseconds) of the server'''
+        lookups = self.cache.hits + self.cache.misses
+        latencies = {}
+        for op, window in self.latencies.items():
+            if not window:
+                continue
+            ordered = sorted(window)
+            latencies[op] = {
+                'count': len(ordered),
+                'mean_ms': 1000 * sum(ordered) / len(ordered),
+                'p50_ms': 1000 * ordered[len(ordered) // 2],
+                'p99_ms': 1000 * ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+                'max_ms': 1000 * ordered[-1],
+            }
+        result = dict(self.counters)
+        result.update({
+            'uptime_s': time.time() - self.started,
+            'cache_size': len(self.cache),
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+            'hit_rate': self.cache.hits / lookups if lookups else None,
+            'in_flight': len(self._in_flight),
+            'latency': latencies,
+        })
+        return result
+
+    async def serve_connection(self, reader, writer, protocol='jsonl'):
+        '''answer the requests on one connection until the client closes it'''
+        pending = set()
+        def encode(response):
+            if protocol == 'msgpack':
+                return msgpack.packb(response, use_bin_type=True)
+            return json.dumps(response).encode('utf-8') + b'\n'
+        async def answer(request):
+            response = await self.handle(request)
+            try:
+                data = encode(response)
+            except (TypeError, ValueError) as error: # every request gets a reply, even if its result can't be sent
+                self.counters['errors'] += 1
+                data = encode({'id': response['id'] if isinstance(response['id'], (int, str)) else None,
+                               'result': None, 'cached': False,
+                               'error': "Can't encode the response: {kind}: {message}".format(
+                                   kind=type(error).__name__, message=error)})
+            writer.write(data)
+            await writer.drain()
+        def start(request):
+            task = asyncio.ensure_future(answer(request))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        try:
+            if protocol == 'msgpack':
+                unpacker = msgpack.Unpacker(raw=False)
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    unpacker.feed(data)
+                    for request in unpacker:
+                        start(request)
+            else:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as error:
+                        self.counters['errors'] += 1
+                        writer.write(json.dumps({'id': None, 'result': None, 'cached': False,
+                                                 'error': 'ValueError: {message}'.format(message=error)}).encode('utf-8') + b'\n')
+                        continue
+                    start(request)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+async def serve(server, socket_path=None, host='127.0.0.1', port=8765, protocol='jsonl'):
+    '''serve requests forever on a Unix socket, or on a TCP port'''
+    def connection(reader, writer):
+        return server.serve_connection(reader, writer, protocol)
+    if socket_path is not None:
+        listener = await asyncio.start_unix_server(connection, path=socket_path)
+        where = socket_path
+    else:
+        listener = await asyncio.start_server(connection, host=host, port=port)
+        where = '{host}:{port}'.format(host=host, port=port)
+    sys.stderr.write('serving on {where}\n'.format(where=where))
+    async with listener:
+        await listener.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve parse, deriv, simplify and evaluate requests.')
+    parser.add_argument('--socket', help='listen on this Unix socket instead of a TCP port')
+    parser.add_argument('--host', default='127.0.0.1', help='TCP address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='TCP port to listen on')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes; 0 works in the server process')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE, help='results kept in the LRU cache')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='most requests sent to a worker at a time')
+    parser.add_argument('--batch-delay', type=float, default=BATCH_DELAY, help='seconds to wait to fill a batch')
+    parser.add_argument('--protocol', choices=['jsonl', 'msgpack'], default='jsonl', help='how requests and responses are framed')
+    args = parser.parse_args(argv)
+    if args.protocol == 'msgpack' and msgpack is None:
+        parser.error('--protocol msgpack needs the msgpack package')
+
+    server = ExpressionServer(args.workers, args.cache_size, args.batch_size, args.batch_delay)
+    try:
+        asyncio.run(serve(server, args.socket, args.host, args.port, args.protocol))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+'''
+Taylor-mode differentiation: truncated power series through the expressions
+in calculus.py
+
+Instead of differentiating the tree again for every order, which makes the
+expression grow exponentially, each node is given a jet: the coefficients
+c0, c1, ..., ck of its Taylor series in t when x is replaced by point + t.
+Jets are propagated through + - * / ^ in one pass over the distinct nodes,
+with the usual recurrences for products, quotients and powers, so every
+node costs O(k^2) operations. The n-th derivative at the point is n! * cn.
+
+The coefficients are numbers (floats, or exact Fractions with exact=True), or
+with symbolic=True, Variable/Operator trees in terms of the expression's
+variables, so taylor(expr, 'x', k, symbolic=True) gives the coefficients as
+functions of x.
+'''
+
+import math
+from fractions import Fraction
+
+from calculus import Variable, Operator, ZERO, ONE, as_expression, fold_node, numeric_value, number_to_variable, unique_nodes
+
+class _NumericField(object):
+    '''arithmetic on floats, or on integers and Fractions when exact'''
+    def __init__(self, exact, values):
+        self.exact = exact
+        self.values = values
+        self.zero = 0
+        self.one = 1 if exact else 1.0
+
+    def constant(self, value):
+        if self.exact:
+            return value if isinstance(value, (int, Fraction)) else Fraction(value)
+        return float(value)
+
+    def leaf(self, name):
+        if name not in self.values:
+            raise ValueError("No value given for variable {name!r}".format(name=name))
+        return self.constant(self.values[name])
+
+    def is_zero(self, a):
+        return a == 0
+
+    def integer(self, a):
+        '''the value of a as an int, or None if it isn't an integer'''
+        if self.exact:
+            return int(a) if Fraction(a).denominator == 1 else None
+        return int(a) if a == int(a) else None
+
+    def add(self, a, b):
+        return a + b
+
+    def sub(self, a, b):
+        return a - b
+
+    def neg(self, a):
+        return -a
+
+    def mul(self, a, b):
+        return a * b
+
+    def div(self, a, b):
+        if self.exact:
+            return Fraction(a) / b
+        return a / b
+
+    def power(self, a, r):
+        if self.exact:
+            exponent = self.integer(r)
+            if exponent is None:
+                raise ValueError("A power with the exponent {r} can't be evaluated exactly".format(r=r))
+            return Fraction(a) ** exponent if exponent < 0 else a ** exponent
+        result = a ** r
+        if isinstance(result, complex):
+            raise ValueError("({a})^({r}) is not a real number".format(a=a, r=r))
+        return result
+
+    def log(self, a):
+        if self.exact:
+            raise ValueError("A power with a variable exponent can't be evaluated exactly")
+        return math.log(a)
+
+    def exp(self, a):
+        return math.exp(a)
+
+class _SymbolicField(object):
+    '''arithmetic on expressions, folding constants and dropping zeros and ones as it goes'''
+    def __init__(self, values):
+        self.values = values
+        self.zero = ZERO
+        self.one = ONE
+
+    def constant(self, value):
+        return number_to_variable(value)
+
+    def leaf(self, name):
+        return self.values.get(name, Variable(name))
+
+    def is_zero(self, a):
+        return a is ZERO
+
+    def integer(self, a):
+        if isinstance(a, Variable):
+            value = numeric_value(a.name)
+            if value is not None and Fraction(value).denominator == 1:
+                return int(value)
+        return None
+
+    def add(self, a, b):
+        return fold_node('+', [a, b])
+
+    def sub(self, a, b):
+        if b is ZERO:
+            return a
+        if a is ZERO:
+            return self.neg(b)
+        return fold_node('-', [a, b])
+
+    def neg(self, a):
+        if isinstance(a, Operator) and a.name == '-' and len(a.children) == 1:
+            return a.children[0]
+        return fold_node('-', [a])
+
+    def mul(self, a, b):
+        if a is ONE or b is ONE: # even where the other is a number too big to fold
+            return b if a is ONE else a
+        return fold_node('*', [a, b])
+
+    def div(self, a, b):
+        if b is ONE or a is ZERO:
+            return a
+        return fold_node('/', [a, b])
+
+    def power(self, a, r):
+        if r is ONE:
+            return a
+        return fold_node('^', [a, r])
+
+    def log(self, a):
+        raise ValueError("Can't expand a power with a variable exponent symbolically")
+
+    exp = log
+
+def _is_constant(jet, field):
+    return all(field.is_zero(coefficient) for coefficient in jet[1:])
+
+def _mul(a, b, field):
+    '''the truncated product of two jets'''
+    if _is_constant(b, field):
+        return [field.mul(coefficient, b[0]) for coefficient in a]
+    if _is_constant(a, field):
+        return [field.mul(a[0], coefficient) for coefficient in b]
+    product = []
+    for k in range(len(a)):
+        total = field.zero
+        for j in range(k + 1):
+            if not (field.is_zero(a[j]) or field.is_zero(b[k - j])):
+                total = field.add(total, field.mul(a[j], b[k - j]))
+        product.append(total)
+    return product
+
+def _div(a, b, field):
+    '''the truncated quotient of two jets: q = a/b, from a = q*b'''
+    if _is_constant(b, field):
+        return [field.div(coefficient, b[0]) for coefficient in a]
+    if field.is_zero(b[0]):
+        raise ZeroDivisionError("The denominator is zero at the expansion point")
+    quotient = []
+    for k in range(len(a)):
+        total = a[k]
+        for j in range(1, k + 1):
+            if not (field.is_zero(b[j]) or field.is_zero(quotient[k - j])):
+                total = field.sub(total, field.mul(b[j], quotient[k - j]))
+        quotient.append(field.div(total, b[0]))
+    return quotient
+
+def _integer_power(a, n, field):
+    '''a^n for an integer n >= 0, by repeated squaring'''
+    result = [field.one] + [field.zero] * (len(a) - 1)
+    while n:
+        if n & 1:
+            result = _mul(result, a, field)
+        n >>= 1
+        if n:
+            a = _mul(a, a, field)
+    return result
+
+def _constant_power(a, r, field):
+    '''a^r for a constant exponent r, from the recurrence k a0 b_k = sum((r*j - k + j) a_j b_(k-j))'''
+    if _is_constant(a, field):
+        return [field.power(a[0], r)] + [field.zero] * (len(a) - 1)
+    n = field.integer(r)
+    if n is not None and n >= 0:
+        return _integer_power(a, n, field)
+    if field.is_zero(a[0]):
+        raise ValueError("Can't expand a power with the exponent {r} about a zero of its base".format(r=r))
+    power = [field.power(a[0], r)]
+    for k in range(1, len(a)):
+        total = field.zero
+        for j in range(1, k + 1):
+            if field.is_zero(a[j]) or field.is_zero(power[k - j]):
+                continue
+            weight = field.sub(field.mul(field.constant(j), r), field.constant(k - j)) # r*j - (k - j)
+            total = field.add(total, field.mul(weight, field.mul(a[j], power[k - j])))
+        power.append(field.div(total, field.mul(field.constant(k), a[0])))
+    return power
+
+def _log(a, field):
+    '''the truncated logarithm of a jet: a' = a * log(a)'''
+    logarithm = [field.log(a[0])]
+    for k in range(1, len(a)):
+        total = field.mul(field.constant(k), a[k])
+        for j in range(1, k):
+            total = field.sub(total, field.mul(field.constant(j), field.mul(logarithm[j], a[k - j])))
+        logarithm.append(field.div(total, field.mul(field.constant(k), a[0])))
+    return logarithm
+
+def _exp(a, field):
+    '''the truncated exponential of a jet: e' = a' * e'''
+    exponential = [field.exp(a[0])]
+    for k in range(1, len(a)):
+        total = field.zero
+        for j in range(1, k + 1):
+            total = field.add(total, field.mul(field.constant(j), field.mul(a[j], exponential[k - j])))
+        exponential.append(field.div(total, field.constant(k)))
+    return exponential
+
+def _jet_of_node(name, jets, field):
+    '''the jet of one operator, given the jets of its children'''
+    if name == '+':
+        result = jets[0]
+        for jet in jets[1:]:
+            result = [field.add(a, b) for a, b in zip(result, jet)]
+        return result
+    if name == '-':
+        if len(jets) == 1:
+            return [field.neg(a) for a in jets[0]]
+        result = jets[0]
+        for jet in jets[1:]:
+            result = [field.sub(a, b) for a, b in zip(result, jet)]
+        return result
+    if name == '*':
+        result = jets[0]
+        for jet in jets[1:]:
+            result = _mul(result, jet, field)
+        return result
+    if name == '/' and len(jets) == 2:
+        return _div(jets[0], jets[1], field)
+    if name == '^' and len(jets) == 2:
+        base, exponent = jets
+        if _is_constant(exponent, field):
+            return _constant_power(base, exponent[0], field)
+        return _exp(_mul(exponent, _log(base, field), field), field) # a^b = exp(b log a)
+    raise ValueError("Can't expand operator {name!r} with {count} operand(s)".format(name=name, count=len(jets)))
+
+def taylor(expr, x, order, point=None, values=None, exact=False, symbolic=False):
+    '''returns the coefficients [c0, c1, ..., c_order] of the Taylor series of
+    expr in x about 'point', that is expr(point + t) = sum(c_n t^n). 'values'
+    gives the values of the other variables.
+
+    Numerically, 'point' is required, and every other variable needs a value.
+    With symbolic=True the coefficients are expressions; 'point' defaults to
+    x itself, and the other variables are left as they are unless 'values'
+    maps them to numbers, strings or expressions.'''
+    values = dict(values or {})
+    if symbolic:
+        field = _SymbolicField(dict((name, as_expression(value)) for name, value in values.items()))
+        start = Variable(x) if point is None else as_expression(point)
+    else:
+        if point is None:
+            raise ValueError("A point is needed to expand {x} about numerically".format(x=x))
+        field = _NumericField(exact, values)
+        start = field.constant(point)
+    jets = {} # node -> jet
+    for node in unique_nodes(expr):
+        if isinstance(node, Variable):
+            value = numeric_value(node.name)
+            if node.name == x:
+                jet = [start, field.one] + [field.zero] * (order - 1)
+            else:
+                jet = [field.constant(value) if value is not None else field.leaf(node.name)] + [field.zero] * order
+            jets[node] = jet[:order + 1]
+        else:
+            jets[node] = _jet_of_node(node.name, [jets[child] for child in node.children], field)
+    return jets[expr]
+
+def derivatives(expr, x, order, point=None, values=None, exact=False, symbolic=False):
+    '''returns [f, f', f'', ...] up to the given order, where f is expr as a
+    function of x, at 'point'. The arguments are the same as for taylor().'''
+    coefficients = taylor(expr, x, order, point, values, exact, symbolic)
+    if symbolic:
+        field = _SymbolicField({})
+        return [field.mul(number_to_variable(math.factorial(n)), coefficient) for n, coefficient in enumerate(coefficients)]
+    return [math.factorial(n) * coefficient for n, coefficient in enumerate(coefficients)]
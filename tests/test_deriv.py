@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import ZERO, str_to_expr
+from evaluate import lambdify
+
+POINT = {'x': 1.5, 'y': -2.0, 'z': 0.75}
+
+class DerivTest(unittest.TestCase):
+    def setUp(self):
+        calculus.clear_caches()
+
+    def value(self, expr):
+        names = sorted(POINT)
+        return lambdify(expr, names)(*[POINT[name] for name in names])
+
+    def numeric_deriv(self, expr, x, h=1e-5):
+        f = lambdify(expr, sorted(POINT))
+        def at(offset):
+            return f(*[POINT[name] + (offset if name == x else 0) for name in sorted(POINT)])
+        return (at(h) - at(-h)) / (2 * h)
+
+    def test_rules(self):
+        for text in ['x^3*y + y^2/x', 'x*y*z', '-(x - y)', 'x - y - z*x', '(x + 1)/(x^2 + y)', '(x*y)^3', '2/x']:
+            expr = str_to_expr(text)
+            derivative = calculus.deriv(expr, 'x')
+            self.assertAlmostEqual(self.value(derivative), self.numeric_deriv(expr, 'x'), places=5, msg=text)
+
+    def test_constants_have_zero_derivative(self):
+        self.assertIs(calculus.deriv(str_to_expr('y^2*z + 3'), 'x'), ZERO)
+        self.assertIs(calculus.deriv(str_to_expr('x'), 'x'), calculus.ONE)
+
+    def test_memoized(self):
+        expr = str_to_expr('(x*y + 1)^3 * (x*y + 1)')
+        self.assertIs(calculus.deriv(expr, 'x'), calculus.deriv(expr, 'x'))
+        self.assertIs(calculus.deriv(expr, 'x', 2), calculus.deriv(calculus.deriv(expr, 'x'), 'x'))
+
+    def test_shared_subexpressions_stay_shared(self):
+        inner = '(x^2 + y)'
+        text = '*'.join([inner] * 2)
+        for n in range(5):
+            text = '({text})*({text})'.format(text=text) # 2^6 uses of the same subexpression
+        expr = str_to_expr(text)
+        derivative = calculus.deriv(expr, 'x')
+        self.assertLess(len(calculus.unique_nodes(derivative)), 100)
+
+    def test_higher_order(self):
+        expr = str_to_expr('x^4*y')
+        self.assertAlmostEqual(self.value(calculus.deriv(expr, 'x', 3)), 24 * POINT['x'] * POINT['y'])
+        self.assertIs(calculus.deriv(expr, 'x', 5).simplify(), ZERO)
+
+    def test_gradient_matches_deriv(self):
+        expr = str_to_expr('x^3*y + y^2/x - z*(x - y)')
+        partials = calculus.gradient(expr)
+        self.assertEqual(sorted(partials), ['x', 'y', 'z'])
+        for name, partial in partials.items():
+            self.assertAlmostEqual(self.value(partial), self.value(calculus.deriv(expr, name)), msg=name)
+        self.assertIs(calculus.gradient(expr, ['w'])['w'], ZERO)
+
+    def test_gradient_variable_exponent(self):
+        with self.assertRaises(ValueError):
+            calculus.gradient(str_to_expr('x^y'), ['y'])
+        self.assertIn('x', calculus.gradient(str_to_expr('x^y'), ['x']))
+
+    def test_jacobian(self):
+        exprs = [str_to_expr('x*y'), str_to_expr('y + z^2'), str_to_expr('3')]
+        rows = calculus.jacobian(exprs)
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(len(row) == 3 for row in rows))
+        for expr, row in zip(exprs, rows):
+            for name, partial in zip(['x', 'y', 'z'], row):
+                self.assertAlmostEqual(self.value(partial), self.value(calculus.deriv(expr, name)))
+        self.assertTrue(all(partial is ZERO for partial in rows[2]))
+
+if __name__ == '__main__':
+    unittest.main()
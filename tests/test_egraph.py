@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+import egraph
+from calculus import str_to_expr
+from evaluate import lambdify
+
+class EGraphTest(unittest.TestCase):
+    def assert_saturates_to(self, text, size, point={'x': 2, 'y': 3, 'z': 5}):
+        expr = str_to_expr(text)
+        result = egraph.saturate(expr)
+        self.assertEqual(len(calculus.unique_nodes(result)), size, text)
+        names = sorted(point)
+        args = [float(point[name]) for name in names]
+        self.assertAlmostEqual(lambdify(result, names)(*args), lambdify(expr, names)(*args))
+
+    def test_binarize(self):
+        self.assertIs(egraph.binarize(str_to_expr('x + y + z')), str_to_expr('(x + y) + z'))
+        self.assertIs(egraph.binarize(str_to_expr('x*y*z - 1')), str_to_expr('(x*y)*z - 1'))
+
+    def test_nary_identities(self):
+        self.assert_saturates_to('1*x*y', 3)
+        self.assert_saturates_to('0 + x + y', 3)
+        self.assert_saturates_to('x*y*0*z', 1)
+
+    def test_constant_folding(self):
+        self.assertIn(egraph.saturate(str_to_expr('2*x*3')), (str_to_expr('6*x'), str_to_expr('x*6')))
+        self.assertIn(egraph.saturate(str_to_expr('(2+3)*x^(4-3)')), (str_to_expr('5*x'), str_to_expr('x*5')))
+        self.assertIs(egraph.saturate(str_to_expr('x*y*0*z + 2^3')), str_to_expr('8'))
+        self.assert_saturates_to('x*2*y*3 + 0', 5)
+        self.assertIs(egraph.saturate(str_to_expr('2/0')), str_to_expr('2/0')) # division by zero isn't folded
+
+    def test_derivative(self):
+        expr = str_to_expr('x*y*z*w + x^3*y')
+        for n in range(3):
+            expr = calculus.deriv(expr, 'x')
+        self.assertEqual(len(calculus.unique_nodes(egraph.saturate(expr))), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+import evaluate
+from evaluate import lambdify
+
+class ArrayLike(object):
+    '''compares element-wise and has no truth value, like a NumPy array'''
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __eq__(self, other):
+        return ArrayLike(item == other for item in self.items)
+
+    def __bool__(self):
+        raise ValueError('The truth value of an array with more than one element is ambiguous')
+
+    def __mul__(self, other):
+        return ArrayLike(item * other for item in self.items)
+
+    __rmul__ = __mul__
+
+class LambdifyTest(unittest.TestCase):
+    def test_integral_decimal_literals(self):
+        self.assertEqual(lambdify(calculus.str_to_expr('x*2.0'))(3), 6)
+        folded = calculus.str_to_expr('2*x*3').simplify(exact=False)
+        self.assertEqual(lambdify(folded)(x=0.5), 3.0)
+
+    def test_array_like_arguments(self):
+        result = lambdify(calculus.str_to_expr('x*2'))(ArrayLike([1, 2]))
+        self.assertEqual(result.items, [2, 4])
+
+    @unittest.skipIf(evaluate.numpy is None, 'NumPy is not installed')
+    def test_numpy_arrays(self):
+        numpy = evaluate.numpy
+        result = lambdify(calculus.str_to_expr('x^2 + y'))(numpy.array([1.0, 2.0, 3.0]), y=1)
+        self.assertEqual(list(result), [2.0, 5.0, 10.0])
+
+if __name__ == '__main__':
+    unittest.main()
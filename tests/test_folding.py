@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import Variable, fold_node, str_to_expr
+
+class FoldingTest(unittest.TestCase):
+    def setUp(self):
+        calculus.clear_caches()
+
+    def assert_simplifies(self, text, expected, exact=True):
+        self.assertIs(str_to_expr(text).simplify(exact=exact), str_to_expr(expected), text)
+
+    def test_exact_folding(self):
+        self.assert_simplifies('2*x*3', '6*x')
+        self.assert_simplifies('2 + x + 3', 'x + 5')
+        self.assertIs(str_to_expr('1/2 + 1/3').simplify(), Variable('5/6'))
+        self.assertIs(str_to_expr('2^-2').simplify(), Variable('1/4'))
+        self.assert_simplifies('2^10', '1024')
+        self.assert_simplifies('x*(2-2)', '0')
+
+    def test_canonical_constant_position(self):
+        x, two = Variable('x'), Variable('2')
+        self.assertIs(fold_node('*', [x, two]), fold_node('*', [two, x]))
+        self.assertIs(fold_node('*', [x, two]).children[0], two)
+        self.assertIs(fold_node('+', [two, x]), fold_node('+', [x, two]))
+        self.assertIs(fold_node('+', [two, x]).children[-1], two)
+        self.assertIs(fold_node('+', [x, Variable('0')]), x)
+        self.assertIs(fold_node('*', [x, Variable('1'), Variable('1')]), x)
+
+    def test_unfoldable(self):
+        half, third = Variable('1/2'), Variable(repr(1 / 3))
+        self.assert_simplifies('1/0', '1/0')
+        self.assert_simplifies('0^-1', '0^-1')
+        self.assertIs(str_to_expr('2^(1/2)').simplify(), fold_node('^', [Variable('2'), half]))
+        self.assertIs(str_to_expr('(-8)^(1/3)').simplify(exact=False), fold_node('^', [Variable('-8'), third])) # complex
+
+    def test_inexact_folding(self):
+        self.assertEqual(float(str_to_expr('2^(1/2)').simplify(exact=False).name), 2 ** 0.5)
+        self.assertEqual(float(str_to_expr('1/3').simplify(exact=False).name), 1 / 3)
+
+    def test_size_limits(self):
+        self.assert_simplifies('2^100000*x', '2^100000*x')
+        self.assert_simplifies('3^5000', '3^5000')
+        self.assertEqual(calculus.numeric_value(str_to_expr('2^4000').simplify().name), 2 ** 4000) # under the limit
+        self.assertIsNone(calculus._apply_numeric('*', [2 ** 8000, 2 ** 8000], True))
+        self.assertIsNone(calculus._apply_numeric('/', [Fraction(1, 2 ** 5000), 2 ** 5000], True))
+        self.assertEqual(calculus._apply_numeric('*', [2 ** 8000, 2], True), 2 ** 8001)
+
+    def test_number_to_variable(self):
+        self.assertIs(calculus.number_to_variable(Fraction(3, 4)), Variable('3/4'))
+        self.assertIs(calculus.number_to_variable(Fraction(4, 2)), Variable('2'))
+        self.assertIs(calculus.number_to_variable(0.5), Variable('0.5'))
+        self.assertIsNone(calculus.number_to_variable(float('inf')))
+        self.assertIsNone(calculus.number_to_variable(float('nan')))
+
+    def test_apply_operator(self):
+        self.assertEqual(calculus.apply_operator('-', [5]), -5)
+        self.assertEqual(calculus.apply_operator('/', [1, 3]), Fraction(1, 3))
+        self.assertEqual(calculus.apply_operator('/', [1.0, 4.0], exact=False), 0.25)
+        with self.assertRaises(ValueError):
+            calculus.apply_operator('^', [2, Fraction(1, 2)])
+        with self.assertRaises(ValueError):
+            calculus.apply_operator('/', [1, 2, 3])
+        with self.assertRaises(ZeroDivisionError):
+            calculus.apply_operator('/', [1, 0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import sys
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from evaluate import IncrementalEvaluator, lambdify
+
+class IncrementalEvaluatorTest(unittest.TestCase):
+    def setUp(self):
+        self.expr = calculus.deriv(calculus.str_to_expr('x^3*y + y^2/x - 1/2*x'), 'x')
+
+    def test_matches_lambdify(self):
+        evaluator = IncrementalEvaluator(self.expr, {'x': 2, 'y': 3})
+        compiled = lambdify(self.expr, ['x', 'y'])
+        self.assertAlmostEqual(evaluator.value(), compiled(2.0, 3.0))
+        evaluator.set('x', 5)
+        self.assertAlmostEqual(evaluator.value(), compiled(5.0, 3.0))
+        evaluator.update({'x': 1, 'y': -2})
+        self.assertAlmostEqual(evaluator.value(), compiled(1.0, -2.0))
+
+    def test_exact(self):
+        evaluator = IncrementalEvaluator(self.expr, {'x': 2, 'y': 3}, exact=True)
+        self.assertEqual(evaluator.value(), Fraction(133, 4))
+        self.assertEqual(list(evaluator.sweep('x', [1, Fraction(1, 3)])), [Fraction(-1, 2), Fraction(-161, 2)])
+
+    def test_only_dependents_are_recomputed(self):
+        expr = calculus.str_to_expr('(x*2 + 1) * (y*3 + 1)')
+        evaluator = IncrementalEvaluator(expr, {'x': 1, 'y': 1})
+        evaluator.value()
+        evaluator.set('y', 2)
+        y_side = calculus.str_to_expr('y*3 + 1')
+        self.assertEqual(sorted(evaluator._stale), sorted(evaluator._position[node] for node in (
+            calculus.str_to_expr('y*3'), y_side, expr)))
+        self.assertEqual(evaluator.value(), 21.0)
+        self.assertEqual(evaluator.value(y_side), 7.0)
+
+    def test_unbound_variables(self):
+        with self.assertRaises(ValueError):
+            IncrementalEvaluator(calculus.str_to_expr('x')).value()
+        with self.assertRaises(ValueError):
+            IncrementalEvaluator(calculus.str_to_expr('x + y'), {'x': 1}).value()
+        self.assertEqual(IncrementalEvaluator(calculus.str_to_expr('x'), {'x': 3}).value(), 3.0)
+        with self.assertRaises(KeyError):
+            IncrementalEvaluator(calculus.str_to_expr('x')).set('y', 1)
+
+    def test_inexact_powers(self):
+        with self.assertRaises(ValueError):
+            IncrementalEvaluator(calculus.str_to_expr('x^(1/2)'), {'x': 2}, exact=True).value()
+        self.assertAlmostEqual(IncrementalEvaluator(calculus.str_to_expr('x^(1/2)'), {'x': 4}).value(), 2.0)
+
+if __name__ == '__main__':
+    unittest.main()
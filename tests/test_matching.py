@@ -0,0 +1,73 @@
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import make_relation, str_to_expr
+
+RULES = ['a - a', '0',
+         'a * a', 'a^2',
+         'a + 0', 'a',
+         '(a + b)*c', 'a*c + b*c',
+         'a^1', 'a',
+         '(a*b)/(a*c)', 'b/c']
+
+EXPRESSIONS = ['x - x', 'x - y', '(x+1) - (x+1)', '(x+1) - (1+x)', 'x*x', 'x*y', '(x*y)*(x*y)',
+               'x + 0', '0 + x', '(x+y)*z', '(x+y)*(x+y)', 'x^1', '(x*y)/(x*z)', '(x*y)/(y*z)', 'x']
+
+class MatchingTest(unittest.TestCase):
+    def test_bindings(self):
+        relation = make_relation('(a + b)*c', 'a*c + b*c')
+        bindings = relation.match(str_to_expr('(x^2 + 1)*y'))
+        self.assertEqual(bindings, {'a': str_to_expr('x^2'), 'b': str_to_expr('1'), 'c': str_to_expr('y')})
+        self.assertIsNone(relation.match(str_to_expr('(x + 1 + 2)*y'))) # the arity must match too
+
+    def test_non_linear_patterns(self):
+        relation = make_relation('a - a', '0')
+        self.assertIs(relation.compare(str_to_expr('(x+1) - (x+1)')), str_to_expr('0'))
+        self.assertIsNone(relation.compare(str_to_expr('x - y')))
+        self.assertIsNone(relation.compare(str_to_expr('(x+1) - (1+x)')))
+
+    def test_literals(self):
+        relation = make_relation('a + 0', 'a')
+        self.assertIs(relation.compare(str_to_expr('x + 0')), str_to_expr('x'))
+        self.assertIsNone(relation.compare(str_to_expr('x + 1')))
+
+    def test_rhs_shares_subexpressions(self):
+        expr = str_to_expr('(x^2 + 1)*(y - 3)')
+        result = make_relation('(a + b)*c', 'a*c + b*c').compare(expr)
+        self.assertIs(result.children[0].children[1], expr.children[1])
+        self.assertIs(result.children[1].children[1], expr.children[1])
+
+    def test_both_ways(self):
+        relation = make_relation('a * a', 'a^2')
+        self.assertIsNone(relation.compare(str_to_expr('x^2')))
+        self.assertIs(relation.compare(str_to_expr('x^2'), both_ways=True), str_to_expr('x*x'))
+
+    def test_compiled_parity(self):
+        pairs = list(zip(RULES[::2], RULES[1::2]))
+        for lhs, rhs in pairs:
+            interpreted = make_relation(lhs, rhs)
+            compiled = make_relation(lhs, rhs).compile()
+            self.assertIsNotNone(compiled.source)
+            for text in EXPRESSIONS:
+                expr = str_to_expr(text)
+                self.assertEqual(compiled.match(expr), interpreted.match(expr), (lhs, text))
+                self.assertIs(compiled.compare(expr), interpreted.compare(expr), (lhs, text))
+
+    def test_compiled_relations_pickle(self):
+        relation = pickle.loads(pickle.dumps(make_relation('a - a', '0').compile()))
+        self.assertIs(relation.compare(str_to_expr('y - y')), str_to_expr('0'))
+        self.assertIsNone(relation.compare(str_to_expr('x - y')))
+
+    def test_simplify_compiled_or_not(self):
+        interpreted = calculus.make_all_relations(calculus.simplifications)
+        compiled = calculus.make_all_relations(calculus.simplifications, compiled=True)
+        expr = calculus.deriv(str_to_expr('x^3*y + x*y*z'), 'x')
+        self.assertIs(expr.simplify(interpreted), expr.simplify(compiled))
+
+if __name__ == '__main__':
+    unittest.main()
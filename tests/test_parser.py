@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import Variable, Operator, str_to_expr
+
+class ParserTest(unittest.TestCase):
+    def assert_parses(self, text, expected):
+        expr = str_to_expr(text)
+        self.assertEqual(expr.collapse() if isinstance(expr, Operator) else expr.name, expected)
+
+    def test_precedence(self):
+        self.assert_parses('1+2*3^4^5', '(1+(2*(3^(4^5))))')
+        self.assert_parses('x-y-z', '((x-y)-z)')
+        self.assert_parses('a/b/c', '((a/b)/c)')
+        self.assert_parses('(x+y)*z', '((x+y)*z)')
+
+    def test_chains_are_flattened(self):
+        self.assertEqual(len(str_to_expr('x + y + z').children), 3)
+        self.assertEqual(len(str_to_expr('x*y*z*w').children), 4)
+        self.assert_parses('(x+y)+z', '((x+y)+z)') # parentheses keep their grouping
+
+    def test_unary_minus(self):
+        self.assert_parses('-x^2', '(-(x^2))')
+        self.assert_parses('-x*y', '((-x)*y)')
+        self.assert_parses('2*-x', '(2*(-x))')
+        self.assertIs(str_to_expr('-3'), Variable('-3'))
+        self.assertIs(str_to_expr('+x'), Variable('x'))
+
+    def test_numeric_literals(self):
+        self.assertIs(str_to_expr('1e3*x').children[0], Variable('1e3'))
+        self.assertIs(str_to_expr('1.5e-2+x').children[0], Variable('1.5e-2'))
+        self.assertIs(str_to_expr('.5'), Variable('.5'))
+        self.assertEqual(calculus.numeric_value('1.5e-2'), Fraction(3, 200))
+
+    def test_error_positions(self):
+        for text, message in [('x+', 'Expected an operand but found end of input'),
+                              ('(x', "Expected ')' but found end of input"),
+                              ('x)', "Expected an operator but found ')' at position 1"),
+                              ('x y', "Expected an operator but found 'y' at position 2"),
+                              ('x $ y', "Unexpected character '$' at position 2"),
+                              ('', 'Expected an operand')]:
+            with self.assertRaises(ValueError) as caught:
+                str_to_expr(text)
+            self.assertIn(message, str(caught.exception), text)
+
+    def test_deep_nesting(self):
+        depth = 5000
+        expr = str_to_expr('(' * depth + 'x' + ')' * depth + '+1')
+        self.assertIs(expr, str_to_expr('x+1'))
+
+    def test_cache(self):
+        self.assertIs(str_to_expr('x  +   y'), str_to_expr('x + y'))
+        self.assertIs(str_to_expr('x + y', cache=False), str_to_expr('x + y'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import str_to_expr
+
+class ProfileTest(unittest.TestCase):
+    def setUp(self):
+        calculus.clear_caches()
+
+    def test_profiled_result_is_the_same(self):
+        expr = calculus.deriv(calculus.deriv(str_to_expr('x^3*y + y^2/x'), 'x'), 'x')
+        expected = expr.simplify()
+        with calculus.profiling() as profile:
+            self.assertIs(expr.simplify(), expected)
+        self.assertEqual(profile.pass_count, 1)
+
+    def test_sections_and_counts(self):
+        with calculus.profiling() as profile:
+            str_to_expr('(x*1 + 0)^1').simplify()
+        self.assertEqual(set(profile.seconds), set(['lookup', 'compare', 'construct', 'fold', 'total']))
+        self.assertGreater(profile.seconds['construct'], 0)
+        for attempts, matches, fires in profile.rules.values():
+            self.assertGreaterEqual(attempts, matches)
+            self.assertGreaterEqual(matches, fires)
+        self.assertGreaterEqual(sum(counts[2] for counts in profile.rules.values()), 1)
+
+if __name__ == '__main__':
+    unittest.main()
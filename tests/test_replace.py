@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import Variable, str_to_expr
+
+class ReplaceTest(unittest.TestCase):
+    def setUp(self):
+        calculus.clear_caches()
+
+    def test_replace_variable(self):
+        expr = str_to_expr('x^2 + x*y')
+        self.assertIs(expr.replace('x', 'z + 1'), str_to_expr('(z + 1)^2 + (z + 1)*y'))
+        self.assertIs(expr.replace(Variable('x'), 3), str_to_expr('3^2 + 3*y'))
+        self.assertIs(Variable('x').replace('x', 'y'), Variable('y'))
+        self.assertIs(Variable('w').replace('x', 'y'), Variable('w'))
+
+    def test_replace_subexpression(self):
+        expr = str_to_expr('(x*y)^2 + 1/(x*y)')
+        self.assertIs(expr.replace('x*y', 't'), str_to_expr('t^2 + 1/t'))
+
+    def test_simultaneous(self):
+        expr = str_to_expr('x - y')
+        self.assertIs(expr.replace({'x': 'y', 'y': 'x'}), str_to_expr('y - x'))
+        self.assertIs(expr.replace({'x': 'x + y'}), str_to_expr('(x + y) - y')) # replacements aren't searched again
+
+    def test_untouched_subtrees_are_reused(self):
+        expr = str_to_expr('(a*b + c)^2 + x')
+        result = expr.replace('x', 'y')
+        self.assertIs(result.children[0], expr.children[0])
+        self.assertIs(expr.replace('z', 'y'), expr)
+        with self.assertRaises(AssertionError):
+            expr.replace({'x': 'y'}, 'z')
+
+    def test_simplified_forms_are_reused(self):
+        index = calculus.default_rules()
+        cache = index.simplified_cache()
+        expr = str_to_expr('(a*1 + 0)*(b + c*1)^1 + x*1')
+        self.assertIs(expr.simplify(), str_to_expr('a*(b + c) + x'))
+        before = len(cache)
+        result = expr.replace('x', 'y')
+        self.assertIs(result.simplify(), str_to_expr('a*(b + c) + y'))
+        self.assertEqual(len(cache) - before, 2) # just y*1 and the new root
+
+if __name__ == '__main__':
+    unittest.main()
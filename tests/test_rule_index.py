@@ -0,0 +1,41 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+from calculus import str_to_expr
+
+class RuleIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.relations = calculus.make_all_relations(calculus.simplifications)
+        self.index = calculus.RuleIndex(self.relations)
+
+    def test_candidates_include_every_match(self):
+        for text in ['x + 0', '0 + x', 'x*1', 'x^0', 'x^1', '(x+y)*0', 'x*y', 'x^2']:
+            expr = str_to_expr(text)
+            candidates = set(self.index.candidate_positions(expr))
+            for position, relation in enumerate(self.relations):
+                if relation.compare(expr) is not None:
+                    self.assertIn(position, candidates, text)
+
+    def test_candidates_are_pruned(self):
+        self.assertEqual(list(self.index.candidate_positions(str_to_expr('x - y'))), [])
+        names = [self.relations[position].str1 for position in self.index.candidate_positions(str_to_expr('x^2'))]
+        self.assertTrue(all('^' in name for name in names))
+
+    def test_simplify_with_an_index_or_a_list(self):
+        expr = str_to_expr('(x*1 + 0)^1')
+        self.assertIs(expr.simplify(self.index), str_to_expr('x'))
+        self.assertIs(expr.simplify(self.relations), str_to_expr('x'))
+
+    def test_index_cache_is_bounded(self):
+        expr = str_to_expr('x*1')
+        for attempt in range(calculus.RULE_INDEX_CACHE_SIZE + 10):
+            expr.simplify(calculus.make_all_relations(calculus.simplifications))
+        self.assertLessEqual(len(calculus._rule_index_cache), calculus.RULE_INDEX_CACHE_SIZE)
+        self.assertIs(calculus.make_rule_index(self.relations), calculus.make_rule_index(self.relations))
+
+if __name__ == '__main__':
+    unittest.main()
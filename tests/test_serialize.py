@@ -0,0 +1,57 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import serialize
+from calculus import str_to_expr
+
+TEXTS = ['x', '3/4', '(2 + x*y^3) + x^2', '-(x - y)/z', 'x*y*z*w + 1', 'café + 1e-05']
+
+class SerializeTest(unittest.TestCase):
+    def setUp(self):
+        self.exprs = [str_to_expr(text) for text in TEXTS]
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        loaded = serialize.loads(serialize.dumps(self.exprs))
+        self.assertEqual(len(loaded), len(self.exprs))
+        for expr, result in zip(self.exprs, loaded):
+            self.assertIs(result, expr)
+        self.assertEqual(serialize.loads(serialize.dumps([])), [])
+
+    def test_shared_nodes_are_written_once(self):
+        expr = str_to_expr('(x*y + 1)^2')
+        one = serialize.dumps([expr])
+        twice = serialize.dumps([expr, expr, str_to_expr('x*y + 1')])
+        self.assertEqual(len(twice) - len(one), 8) # just the two extra roots
+
+    def test_file_corpus(self):
+        path = os.path.join(self.directory, 'corpus.symx')
+        serialize.dump(self.exprs, path)
+        with serialize.load(path) as corpus:
+            self.assertEqual(len(corpus), len(self.exprs))
+            built = corpus[2]
+            self.assertIs(built, self.exprs[2])
+            self.assertIs(corpus[-1], self.exprs[-1])
+            self.assertEqual(list(corpus), self.exprs)
+            with self.assertRaises(IndexError):
+                corpus[len(self.exprs)]
+        self.assertEqual(built.collapse(), self.exprs[2].collapse()) # built expressions outlive close()
+
+    def test_bad_data(self):
+        with self.assertRaises(ValueError):
+            serialize.loads(b'SYM')
+        with self.assertRaises(ValueError):
+            serialize.loads(b'XXXX' + serialize.dumps(self.exprs)[4:])
+        with self.assertRaises(ValueError):
+            serialize.loads(serialize.dumps(self.exprs)[:-4])
+
+if __name__ == '__main__':
+    unittest.main()
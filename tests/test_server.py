@@ -0,0 +1,91 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import server
+
+class FakeWriter(object):
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+class ExpressionServerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = server.ExpressionServer(workers=0)
+
+    async def test_deriv_is_cached(self):
+        request = {'id': 1, 'op': 'deriv', 'expr': 'x^2*y', 'wrt': 'x'}
+        first = await self.server.handle(request)
+        second = await self.server.handle(request)
+        self.assertEqual(first['result'], '((2*x)*y)')
+        self.assertEqual((first['cached'], second['cached']), (False, True))
+
+    async def test_identical_requests_are_coalesced(self):
+        request = {'op': 'simplify', 'expr': 'x*1 + 0'}
+        responses = await asyncio.gather(*[self.server.handle(request) for index in range(5)])
+        self.assertEqual([response['result'] for response in responses], ['x'] * 5)
+        self.assertEqual(self.server.counters['computed'], 1)
+        self.assertEqual(self.server.counters['coalesced'], 4)
+
+    async def test_value_types_are_part_of_the_key(self):
+        exact = await self.server.handle({'op': 'evaluate', 'expr': 'x^400', 'values': {'x': 10}})
+        floating = await self.server.handle({'op': 'evaluate', 'expr': 'x^400', 'values': {'x': 10.0}})
+        self.assertEqual(exact['result'], 10 ** 400)
+        self.assertIn('OverflowError', floating['error'])
+
+    async def test_complex_results_are_errors(self):
+        response = await self.server.handle({'id': 7, 'op': 'evaluate', 'expr': 'z^0.5', 'values': {'z': -4}})
+        self.assertIsNone(response['result'])
+        self.assertIn('not a finite real number', response['error'])
+        self.assertEqual(len(self.server.cache), 0) # errors aren't cached
+
+    async def test_every_request_gets_a_reply(self):
+        lines = [{'id': 1, 'op': 'parse', 'expr': 'x + y*z'},
+                 {'id': 2, 'op': 'evaluate', 'expr': 'z^0.5', 'values': {'z': -4}},
+                 {'id': 3, 'op': 'bogus'}]
+        reader = asyncio.StreamReader()
+        reader.feed_data(b''.join(json.dumps(line).encode('utf-8') + b'\n' for line in lines) + b'not json\n')
+        reader.feed_eof()
+        writer = FakeWriter()
+        await self.server.serve_connection(reader, writer)
+        responses = [json.loads(line) for line in writer.data.splitlines()]
+        self.assertEqual(sorted(str(response['id']) for response in responses), ['1', '2', '3', 'None'])
+        by_id = dict((response['id'], response) for response in responses)
+        self.assertEqual(by_id[1]['result'], '(x+(y*z))')
+        self.assertIsNotNone(by_id[2]['error'])
+        self.assertIsNotNone(by_id[3]['error'])
+
+    async def test_unencodable_results_still_get_a_reply(self):
+        async def handle(request):
+            return {'id': request['id'], 'result': object(), 'error': None, 'cached': False}
+        self.server.handle = handle
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'{"id": 9, "op": "parse", "expr": "x"}\n')
+        reader.feed_eof()
+        writer = FakeWriter()
+        await self.server.serve_connection(reader, writer)
+        response = json.loads(writer.data)
+        self.assertEqual(response['id'], 9)
+        self.assertIn("Can't encode", response['error'])
+
+    async def test_metrics(self):
+        await self.server.handle({'op': 'simplify', 'expr': 'x*1'})
+        await self.server.handle({'op': 'simplify', 'expr': 'x*1'})
+        metrics = (await self.server.handle({'op': 'metrics'}))['result']
+        self.assertEqual(metrics['hit_rate'], 0.5)
+        self.assertEqual(metrics['latency']['simplify']['count'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
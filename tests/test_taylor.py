@@ -0,0 +1,58 @@
+import os
+import sys
+import unittest
+from fractions import Fraction
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import calculus
+import taylor
+from evaluate import lambdify
+
+class TaylorTest(unittest.TestCase):
+    def assert_matches_deriv(self, text, order, point, values):
+        expr = calculus.str_to_expr(text)
+        names = ['x'] + sorted(values)
+        args = [float(point)] + [float(values[name]) for name in sorted(values)]
+        expected = [lambdify(calculus.deriv(expr, 'x', n), names)(*args) for n in range(order + 1)]
+        got = taylor.derivatives(expr, 'x', order, point=point, values=values)
+        for n, (value, want) in enumerate(zip(got, expected)):
+            self.assertAlmostEqual(value, want, delta=1e-9 * max(1.0, abs(want)), msg='order {n}'.format(n=n))
+
+    def test_matches_deriv(self):
+        self.assert_matches_deriv('x^3*y + y^2/x - 1/2*x', 5, 2, {'y': 3})
+        self.assert_matches_deriv('(x*y + 1)/(x^2 + 1)', 5, 0.5, {'y': 3})
+        self.assert_matches_deriv('(x^2 + 1)^(1/2)/(x + y)', 4, 2, {'y': 1})
+        self.assert_matches_deriv('-(x - y)^3', 4, 1, {'y': 2})
+
+    def test_exact(self):
+        expr = calculus.str_to_expr('x^3*y + y^2/x - 1/2*x')
+        self.assertEqual(taylor.derivatives(expr, 'x', 3, point=2, values={'y': 3}, exact=True),
+                         [Fraction(55, 2), Fraction(133, 4), Fraction(153, 4), Fraction(117, 8)])
+        with self.assertRaises(ValueError):
+            taylor.taylor(calculus.str_to_expr('x^(1/2)'), 'x', 2, point=2, exact=True)
+
+    def test_geometric_series(self):
+        coefficients = taylor.taylor(calculus.str_to_expr('1/(1-x)'), 'x', 5, point=0, symbolic=True)
+        self.assertEqual([coefficient.collapse() for coefficient in coefficients], ['1'] * 6)
+
+    def test_symbolic_matches_deriv(self):
+        expr = calculus.str_to_expr('x^3*y + y^2/x')
+        symbolic = taylor.derivatives(expr, 'x', 3, symbolic=True)
+        for n, derivative in enumerate(symbolic):
+            want = lambdify(calculus.deriv(expr, 'x', n), ['x', 'y'])(1.5, 2.0)
+            self.assertAlmostEqual(lambdify(derivative, ['x', 'y'])(1.5, 2.0), want)
+
+    def test_variable_exponent(self):
+        value, first = taylor.taylor(calculus.str_to_expr('x^x'), 'x', 1, point=1.5)
+        self.assertAlmostEqual(value, 1.5 ** 1.5)
+        self.assertAlmostEqual(first, 1.5 ** 1.5 * (1 + 0.4054651081081644))
+        with self.assertRaises(ValueError):
+            taylor.taylor(calculus.str_to_expr('x^x'), 'x', 1, symbolic=True)
+
+    def test_high_orders(self):
+        derivatives = taylor.derivatives(calculus.str_to_expr('1/(1-x)'), 'x', 1100, point=0, symbolic=True)
+        self.assertIsInstance(derivatives[-1], calculus.Variable) # 1100!, too big to fold but still a leaf
+
+if __name__ == '__main__':
+    unittest.main()